@@ -1,7 +1,7 @@
 #! /usr/bin/bash
 
 short_opt_str=':vd:rih'
-long_opt_str=':verbose,device:,reset,id,temp,read,test,rtd,sd,help'
+long_opt_str=':verbose,device:,reset,id,temp,read,test,rtd,sd,daemon,query,help'
 
 VALID_ARGS=$(getopt -o "$short_opt_str" -l "$long_opt_str" -- "$@")
 if [ $? -ne 0 ]; then
@@ -58,6 +58,16 @@ while true; do
         # break
         shift
         ;;
+    '--daemon')
+        DAEMON=true
+        # break
+        shift
+        ;;
+    '--query')
+        QUERY=true
+        # break
+        shift
+        ;;
     '--')
         shift
         break
@@ -81,6 +91,17 @@ else
     COMMAND="uv run src/hs_temp_sensor $DEVICE $OPT"
 fi
 
+# A running daemon already holds the configured ADCs; query it without updating
+if [ "$QUERY" = true ]; then
+    PRECOMMANDS="source $HOME/.profile &&"
+    PRECOMMANDS+="cd $HOME/hs-temp-sensor &&"
+    COMMAND="uv run --no-sync src/hs_temp_sensor --query"
+fi
+
+if [ "$DAEMON" = true ]; then
+    COMMAND="nohup uv run src/hs_temp_sensor --daemon < /dev/null > /dev/null 2>&1 &"
+fi
+
 ssh $SERVER $PRECOMMANDS $COMMAND;
 
 exit 0;
\ No newline at end of file
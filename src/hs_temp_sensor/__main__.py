@@ -1,7 +1,11 @@
 import argparse
+import functools
+import os
+import tempfile
+import time
 from logging import getLogger, basicConfig, DEBUG, CRITICAL, ERROR, WARNING, INFO
 
-from hs_temp_sensor import ad7124
+from hs_temp_sensor import ad7124, benchmark, calibration, curves, daemon, export, filters, metrics, scheduler, shm, simulator, store, topology, trace
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="HISPEC 4-wire Temperature Sensor Test Software")
@@ -17,6 +21,41 @@ def main() -> None:
     parser.add_argument("--rtd", action="store_true", help="RTD measurement")
     parser.add_argument("--sd", action="store_true", help="Silicon Diode measurement")
     parser.add_argument("--test", action="store_true", help="Run a test sequence")
+    parser.add_argument("--benchmark", action="store_true", help="Benchmark the acquisition modes against a simulated ADC")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Simulated conversion time scale for --benchmark, 0 for instant conversions (default: 1.0)")
+    parser.add_argument("--metrics", action="store_true", help="Print SPI and acquisition metrics (Prometheus text format) after the run")
+    parser.add_argument("--metrics-port", type=int, help="Serve daemon metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--calibration", help="Sensor calibration file (JSON) for converting readings to kelvin")
+    parser.add_argument("--daemon", action="store_true", help="Keep the ADCs configured and serve readings on a socket")
+    parser.add_argument("--query", action="store_true", help="Query the latest readings from a running daemon")
+    parser.add_argument("--watch", action="store_true", help="Print raw samples live from a running daemon's shared memory ring (see --shm)")
+    parser.add_argument("--socket", default=daemon.DAEMON_SOCKET,
+                        help="Daemon socket, a Unix socket path or host:port (default: {})".format(daemon.DAEMON_SOCKET))
+    parser.add_argument("--log", help="Append every raw daemon sample to this binary sample log")
+    parser.add_argument("--shm", nargs="?", const=shm.SHM_NAME,
+                        help="Publish every raw daemon sample to a shared memory ring for local readers (default name: {})".format(shm.SHM_NAME))
+    parser.add_argument("--export", help="Write daemon readings to gzip-compressed CSV chunks in this directory")
+    parser.add_argument("--deadband", help="Per-channel change thresholds and heartbeats (JSON) deciding which readings --export writes")
+    parser.add_argument("--filter", help="Filter daemon readings across scans, e.g. \"median:5,iir:0.2\" (stages: reject, average:N, decimate:N, median:N, iir:ALPHA)")
+    parser.add_argument("--interval", type=float, default=daemon.DAEMON_INTERVAL,
+                        help="Daemon sampling interval in seconds (default: {})".format(daemon.DAEMON_INTERVAL))
+    parser.add_argument("--settle-times", help="Per-channel excitation settle times (JSON) measured by --commission")
+    parser.add_argument("--cal-cache", default=calibration.CALIBRATION_CACHE,
+                        help="On-chip calibration coefficient cache (default: {})".format(calibration.CALIBRATION_CACHE))
+    parser.add_argument("--no-chip-cal", action="store_true", help="Skip on-chip offset/gain calibration")
+    parser.add_argument("--recalibrate", action="store_true", help="Recalibrate on-chip offset/gain even if cached coefficients are fresh")
+    parser.add_argument("--register-state",
+                        help="Keep each chip's register state in this directory: the next run verifies it with one readback instead of resetting and reconfiguring")
+    parser.add_argument("--topology", help="Board topology file (JSON) for --daemon, --test and --commission instead of the two built-in boards")
+    parser.add_argument("--record", help="Append every SPI transfer to this binary trace")
+    parser.add_argument("--replay", help="Run against a recorded SPI trace instead of the hardware; with --benchmark, time the replay")
+    parser.add_argument("--crc", action="store_true", help="Check every SPI transfer with the AD7124 CRC-8")
+    parser.add_argument("--spi-speed", type=int, default=ad7124.AD7124_SPI_MAX_SPEED,
+                        help="SPI clock in Hz (default: {})".format(ad7124.AD7124_SPI_MAX_SPEED))
+    parser.add_argument("--calibrate-spi", action="store_true",
+                        help="Step the SPI clock up at startup and keep the fastest rate with clean CRC readbacks (implies --crc)")
+    parser.add_argument("--commission", action="store_true", help="Measure excitation settle times and save them to --settle-times")
     
     # log_levels = {
     #     0: CRITICAL,
@@ -36,37 +75,169 @@ def main() -> None:
     #     format='%(asctime)s %(name)s:%(lineno)s [%(levelname)s]: %(message)s'
     # )
     
+    if args.benchmark and args.replay:
+        print(benchmark.report(benchmark.replay(args.replay, builtin_tests(), crc=args.crc)))
+        
+        return
+    
+    if args.benchmark:
+        benchmarks = benchmark.BENCHMARKS | {"test_{}".format(kind): board_benchmark(kind) for kind in topology.BUILTIN_BOARDS.values()}
+        # Also checks that the --test flow records and replays identically
+        round_trip = benchmark.round_trip({device: (BUILTIN_SIGNALS[topology.BUILTIN_BOARDS[device]], function)
+                                           for device, function in builtin_tests().items()}, crc=args.crc)
+        print(benchmark.report(benchmark.run(benchmarks, time_scale=args.time_scale) | round_trip))
+        
+        return
+    
+    if args.query:
+        response = daemon.query(args.socket)
+        if response["timestamp"] is None:
+            print("No readings available yet")
+            return
+        
+        print("Timestamp:                   {}".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(response["timestamp"]))))
+        for name, value in response["readings"].items():
+            print("{:<29}{:.5f}".format(name + ":", value))
+        
+        return
+    
+    if args.watch:
+        reader = shm.SharedRingReader(args.shm or shm.SHM_NAME)
+        try:
+            for timestamp, device, channel, status, code in reader.follow():
+                print("{:.6f} device {} channel {:<2} status 0x{:02X} code 0x{:06X}".format(timestamp, device, channel, status, code))
+        except KeyboardInterrupt:
+            pass
+        reader.close()
+        
+        return
+    
+    calibrations = curves.load_calibrations(args.calibration) if args.calibration else {}
+    
+    spi_options = {"crc": args.crc or args.calibrate_spi, "max_speed_hz": args.spi_speed}
+    chip_cal = {"cal_cache": None if args.no_chip_cal else args.cal_cache, "recalibrate": args.recalibrate}
+    if args.replay:
+        # The calibration decisions are the recorded run's, not the local cache's
+        spi_options["poll_interval"] = 0
+        replay_directory = tempfile.TemporaryDirectory()
+        chip_cal = trace.replay_calibration(args.replay, os.path.join(replay_directory.name, "calibration.json"))
+    writer = trace.TraceWriter(args.record) if args.record else None
+    if writer is not None:
+        trace.save_calibration(args.record, **chip_cal)
+    
+    def transport():
+        # Each chip needs its own transport; None opens the spidev device
+        if args.replay:
+            return trace.ReplayTransport(args.replay)
+        if writer is not None:
+            return trace.RecordingTransport(writer)
+        return None
+    
+    def load_system(with_metrics=False):
+        # --topology, or the built-in boards, connected
+        system = topology.load_topology(args.topology, with_metrics=with_metrics, spi_factory=transport,
+                                        state=args.register_state, **spi_options)
+        if args.settle_times and not args.commission:
+            system.set_settle_times(scheduler.load_settle_times(args.settle_times))
+        system.connect(args.calibrate_spi)
+        
+        return system
+    
+    if args.commission:
+        if not args.settle_times:
+            parser.error("--commission needs --settle-times")
+        
+        system = load_system()
+        results = system.commission()
+        scheduler.save_settle_times(args.settle_times, results)
+        for board, settle_times in results.items():
+            for channel, seconds in settle_times.items():
+                print("{:<29}{:.4f} [s]".format("{} channel {} settle:".format(board.upper(), channel), seconds))
+        
+        for adc in system.adcs:
+            adc.close()
+        
+        return
+    
+    if args.daemon:
+        # Checked before the chips are touched: a second daemon would reset
+        # them under the first, and the bus locks only work within a process
+        if daemon.running(args.socket):
+            parser.error("A daemon is already serving on {}".format(args.socket))
+        
+        system = load_system(bool(args.metrics_port))
+        system.configure(**chip_cal)
+        names = system.reading_names
+        
+        if args.metrics_port:
+            metrics_server = metrics.serve([adc.metrics for adc in system.adcs], args.metrics_port)
+        
+        samples = store.SampleStore(log_path=args.log, shared=shm.SharedRing(args.shm) if args.shm else None)
+        for adc in system.adcs:
+            adc.sink = samples
+        
+        exporter = export.CSVExporter(args.export) if args.export else None
+        if exporter is not None:
+            exporter.start()
+        deadband = export.load_deadband(args.deadband) if args.deadband else None
+        
+        pipeline = filters.parse_pipeline(args.filter) if args.filter else None
+        filtered = {}
+        
+        def sample():
+            first = samples.ring.count
+            readings = system.read()
+            if pipeline is not None:
+                # Each reading was converted from the first sample of its
+                # channel in the scan, whose status byte the sink kept
+                statuses = {}
+                for timestamp, source, channel, status, code in samples.ring.latest(samples.ring.count - first):
+                    statuses.setdefault(names.get((source, channel)), status)
+                # Averaging and decimating stages only emit on some scans, so
+                # the latest output of each reading is served in between
+                filtered.update(pipeline.apply(readings, statuses))
+                readings = dict(filtered)
+            for channel, temperature in curves.apply(calibrations, readings).items():
+                readings[channel + "_temp"] = temperature
+            if exporter is not None:
+                now = time.time()
+                exporter.submit(now, readings if deadband is None else deadband.apply(readings, now))
+            
+            return readings
+        
+        daemon.serve(sample, args.socket, args.interval)
+        samples.close()
+        if exporter is not None:
+            exporter.close()
+        if args.metrics_port:
+            metrics_server.shutdown()
+        
+        system.close()
+        
+        return
+    
     if args.test:
-        # print("Running test sequence...")
-        adc0 = ad7124.AD7124(0)
-        adc1 = ad7124.AD7124(1)
-        
-        adc0.connect()
-        die_temp_0, res_a, res_b, res_c, res_d = test_rtd(adc0)
-        adc1.connect()
-        die_temp_1, vol_e, vol_f, vol_g, vol_h = test_sd(adc1)
-        
-        print("ADC 0 Chip Temperature:      {:.5f} [°C]".format(die_temp_0))
-        print("ADC 1 Chip Temperature:      {:.5f} [°C]".format(die_temp_1))
-        print("RTD Channel A Resistance:    {:.5f} [Ω]".format(res_a))
-        print("RTD Channel B Resistance:    {:.5f} [Ω]".format(res_b))
-        print("RTD Channel C Resistance:    {:.5f} [Ω]".format(res_c))
-        print("RTD Channel D Resistance:    {:.5f} [Ω]".format(res_d))
-        print("SD Channel E Voltage:        {:.5f} [V]".format(vol_e))
-        print("SD Channel F Voltage:        {:.5f} [V]".format(vol_f))
-        print("SD Channel G Voltage:        {:.5f} [V]".format(vol_g))
-        print("SD Channel H Voltage:        {:.5f} [V]".format(vol_h))
-        
-        adc0.close()
-        adc1.close() 
+        system = load_system(args.metrics)
+        system.configure(**chip_cal)
+        readings = system.read()
+        system.close()
+        
+        print_readings(system.boards, readings)
+        for channel, temperature in curves.apply(calibrations, readings).items():
+            print("{:<29}{:.3f} [K]".format(channel + " Temperature:", temperature))
+        
+        if args.metrics:
+            print(metrics.prometheus_text([adc.metrics for adc in system.adcs]), end="")
         
         return
     
-    logger.info("Using SPI device: {}".format(args.device))
-    logger.debug("Verbosity level: {}".format(args.verbosity))
+    logger.info("Using SPI device: %s", args.device)
+    logger.debug("Verbosity level: %s", args.verbosity)
     
-    adc = ad7124.AD7124(args.device)
+    adc = ad7124.AD7124(args.device, metrics=metrics.Metrics(args.device) if args.metrics else None, spi=transport(), **spi_options)
     adc.connect()
+    if args.calibrate_spi:
+        adc.calibrate_spi_speed()
     
     if args.reset:
         adc.reset()
@@ -104,138 +275,54 @@ def main() -> None:
     if args.read:
         if args.rtd:
             logger.debug("Running RTD test...")
-            die_temp, res_a, res_b, res_c, res_d = test_rtd(adc)
-            
-            print("ADC {} Chip Temperature:     {:.5f} [°C]".format(args.device, die_temp))
-            print("RTD Channel A Resistance:    {:.5f} [Ω]".format(res_a))
-            print("RTD Channel B Resistance:    {:.5f} [Ω]".format(res_b))
-            print("RTD Channel C Resistance:    {:.5f} [Ω]".format(res_c))
-            print("RTD Channel D Resistance:    {:.5f} [Ω]".format(res_d))
+            board = topology.builtin_board("rtd", adc)
         elif args.sd:
             logger.debug("Running Silicon Diode test...")
-            die_temp, vol_e, vol_f, vol_g, vol_h = test_sd(adc)
-            
-            print("ADC {} Chip Temperature:     {:.5f} [°C]".format(args.device, die_temp))
-            print("SD Channel E Resistance:     {:.5f} [V]".format(vol_e))
-            print("SD Channel F Resistance:     {:.5f} [V]".format(vol_f))
-            print("SD Channel G Resistance:     {:.5f} [V]".format(vol_g))
-            print("SD Channel H Resistance:     {:.5f} [V]".format(vol_h))
+            board = topology.builtin_board("diode", adc)
         else:
             print("No test specified. Use --rtd or --sd for specific tests.")
             return
         
-    adc.close()
-    
-    
-def test_rtd(adc: ad7124.AD7124):
-    adc.initialize()
-    
-    id_reg, dev_id, silicon_rev = adc.read_id()
+        if args.settle_times:
+            board.scheduler.settle_times = scheduler.load_settle_times(args.settle_times).get(board.name, {})
+        print_readings([board], board.test(**chip_cal))
         
-    adc.set_adc_config()
-    adc.set_config(gain=16, cfg_channel=0)
-    
-    adc.set_channel_config(channel=0, setup=0, ainp=16, ainm=17)
-    ch0_data, ch0_status = adc.read_data()
-    adc.read_status()
-    adc.set_channel_config(channel=0, disable=True)
-    
-    adc.set_io_control(iout0_ch=1, ex_cur=500, io_control=1)
-    adc.set_channel_config(channel=1, setup=0, ainp=2, ainm=3)
-    ch1_data, ch1_status = adc.read_data()
-    adc.read_status()
-    adc.set_channel_config(channel=1, disable=True)
+    adc.close()
     
-    adc.set_io_control(iout0_ch=4, ex_cur=500, io_control=1)
-    adc.set_channel_config(channel=2, setup=0, ainp=5, ainm=6)
-    ch2_data, ch2_status = adc.read_data()
-    adc.read_status()
-    adc.set_channel_config(channel=2, disable=True)
+    if args.metrics:
+        print(metrics.prometheus_text([adc.metrics]), end="")
     
-    adc.set_io_control(iout0_ch=8, ex_cur=500, io_control=1)
-    adc.set_channel_config(channel=3, setup=0, ainp=9, ainm=10)
-    ch3_data, ch3_status = adc.read_data()
-    adc.read_status()
-    adc.set_channel_config(channel=3, disable=True)
     
-    adc.set_io_control(iout0_ch=11, ex_cur=500, io_control=1)
-    adc.set_channel_config(channel=4, setup=0, ainp=12, ainm=13)
-    ch4_data, ch4_status = adc.read_data()
-    adc.read_status()
-    adc.set_channel_config(channel=4, disable=True)
-        
-    die_temp = adc.read_die_temp(ch0_data)
+BUILTIN_SIGNALS = {"rtd": simulator.rtd_signals, "diode": simulator.diode_signals}
 
-    res_a =  adc.rtd_test_conversion(ch1_data)
-    res_b = adc.rtd_test_conversion(ch2_data)
-    res_c = adc.rtd_test_conversion(ch3_data)
-    res_d = adc.rtd_test_conversion(ch4_data)
-    
-    adc.reset()
-    
-    # print("Die Temperature: {:.5f} °C".format(die_temp))
-    # print("RTD Channel A Resistance: {:.5f} Ohm".format(res_a))
-    # print("RTD Channel B Resistance: {:.5f} Ohm".format(res_b))
-    # print("RTD Channel C Resistance: {:.5f} Ohm".format(res_c))
-    # print("RTD Channel D Resistance: {:.5f} Ohm".format(res_d))
-    
-    return die_temp, res_a, res_b, res_c, res_d
-    
-def test_sd(adc: ad7124.AD7124):
-    adc.initialize()
-    
-    id_reg, dev_id, silicon_rev = adc.read_id()
-        
-    adc.set_adc_config()
-    adc.set_config(gain=1, cfg_channel=0)
-    adc.read_config()
-    
-    
-    adc.set_channel_config(channel=0, setup=0, ainp=16, ainm=17)
-    ch0_data, ch0_status = adc.read_data()
-    adc.read_status()
-    adc.set_channel_config(channel=0, disable=True)
-    
-    adc.set_io_control(iout0_ch=1,  ex_cur=50, io_control=1)
-    adc.set_channel_config(channel=1, setup=0, ainp=2, ainm=3)
-    ch1_data, ch1_status = adc.read_data()
-    adc.read_status()
-    adc.set_channel_config(channel=1, disable=True)
-    
-    adc.set_io_control(iout0_ch=4, ex_cur=50, io_control=1)
-    adc.set_channel_config(channel=2, setup=0, ainp=5, ainm=6)
-    ch2_data, ch2_status = adc.read_data()
-    adc.read_status()
-    adc.set_channel_config(channel=2, disable=True)
-    
-    adc.set_io_control(iout0_ch=8, ex_cur=50, io_control=1)
-    adc.set_channel_config(channel=3, setup=0, ainp=9, ainm=10)
-    ch3_data, ch3_status = adc.read_data()
-    adc.read_status()
-    adc.set_channel_config(channel=3, disable=True)
-    
-    adc.set_io_control(iout0_ch=11, ex_cur=50, io_control=1)
-    adc.set_channel_config(channel=4, setup=0, ainp=12, ainm=13)
-    ch4_data, ch4_status = adc.read_data()
-    adc.read_status()
-    adc.set_channel_config(channel=4, disable=True)
-    
-    die_temp = adc.read_die_temp(ch0_data)
-    
-    vol_e = adc.sd_test_conversion(ch1_data)
-    vol_f = adc.sd_test_conversion(ch2_data)
-    vol_g = adc.sd_test_conversion(ch3_data)
-    vol_h = adc.sd_test_conversion(ch4_data)
+def print_readings(boards, readings):
+    for board in boards:
+        print("{:<29}{:.5f} [°C]".format("{} Chip Temperature:".format(board.name.upper()), readings[board.names[topology.DIE_TEMP_CHANNEL]]))
+    for board in boards:
+        for sensor in board.sensors:
+            kind = topology.SENSOR_TYPES[sensor.type]
+            print("{:<29}{:.5f} [{}]".format("{} {}:".format(sensor.name, kind.quantity), readings[sensor.name], kind.unit))
+
+def test_board(kind, adc: ad7124.AD7124, cal_cache=None, recalibrate=False):
+    return topology.builtin_board(kind, adc).test(cal_cache, recalibrate)
+
+def builtin_tests():
+    # {chip select: function(adc, cal_cache, recalibrate)} running the
+    # built-in board on that chip once, as benchmark.replay takes them
+    return {device: functools.partial(test_board, kind) for device, kind in topology.BUILTIN_BOARDS.items()}
+
+def board_benchmark(kind):
+    # A benchmark.run entry scanning the built-in board of `kind` on a simulated chip
+    boards = {}
     
-    adc.reset()
+    def configure(adc: ad7124.AD7124):
+        boards[adc] = topology.builtin_board(kind, adc)
+        boards[adc].configure()
     
-    # print("Die Temperature: {:.5f} °C".format(die_temp))
-    # print("SD Channel E Resistance: {:.5f} Ohm".format(vol_e))
-    # print("SD Channel F Resistance: {:.5f} Ohm".format(vol_f))
-    # print("SD Channel G Resistance: {:.5f} Ohm".format(vol_g))
-    # print("SD Channel H Resistance: {:.5f} Ohm".format(vol_h))
+    def measure(adc: ad7124.AD7124):
+        return len(boards[adc].read())
     
-    return die_temp, vol_e, vol_f, vol_g, vol_h
+    return BUILTIN_SIGNALS[kind], configure, measure
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
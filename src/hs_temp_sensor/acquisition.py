@@ -0,0 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from logging import getLogger
+import time
+
+logger = getLogger(__name__)
+
+
+def acquire(jobs, max_workers=None):
+    # Each job runs a blocking measurement sequence against its own AD7124.
+    # Conversion waits sleep outside the GIL, so the chips convert in parallel
+    # while their SPI transfers are serialized per bus by the driver.
+    results = {}
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers or len(jobs)) as pool:
+        futures = {pool.submit(function, adc): name for name, (adc, function) in jobs.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            results[name] = future.result()
+            logger.debug("Acquisition %s finished after %.3f s", name, time.monotonic() - start)
+    
+    return results
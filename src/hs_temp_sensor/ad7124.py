@@ -1,14 +1,38 @@
+from dataclasses import dataclass
 from logging import getLogger
-import spidev
+import json
+import threading
 import time
 
+from hs_temp_sensor import conversion
+
+try:
+    import spidev
+except ImportError:
+    spidev = None
+
 logger = getLogger(__name__)
 
 AD7124_SPI_BUS = 0
 AD7124_SPI_DEVICE = 0
 AD7124_SPI_MODE = 3
 AD7124_SPI_MAX_SPEED = 1000000
+# Clock rates tried by calibrate_spi_speed(), up to the 5 MHz datasheet limit
+AD7124_SPI_SPEEDS = (1000000, 2000000, 3000000, 4000000, 5000000)
+AD7124_SPI_CALIBRATION_READS = 50
 
+# One lock per SPI bus; chips on separate chip-selects still share the clock and data lines
+AD7124_BUS_LOCKS = {}
+
+AD7124_READY_TIMEOUT = 1.0
+AD7124_READY_POLL_INTERVAL = 0.0005
+AD7124_READY_POLL_MAX_INTERVAL = 0.01
+AD7124_READY_POLL_BACKOFF = 2
+# Without DOUT/RDY, stream() clocks each frame this fraction of a conversion
+# period after the conversion is due
+AD7124_STREAM_MARGIN = 0.1
+# A calibration runs several settled conversions at mid power
+AD7124_CALIBRATION_TIMEOUT = 5.0
 
 AD7124_COMMS_REG = 0x00
 AD7124_COMM_REG_WEN = 0 << 7
@@ -17,6 +41,10 @@ AD7124_COMM_REG_RD = 1 << 6
 AD7124_COMM_REG_RA = lambda x : (x & 0x3F)
 
 AD7124_STATUS_REG = 0x00
+AD7124_STATUS_REG_RDY = 1 << 7
+AD7124_STATUS_REG_ERROR_FLAG = 1 << 6
+AD7124_STATUS_REG_POR_FLAG = 1 << 4
+AD7124_STATUS_REG_CH_ACTIVE = lambda x : (x & 0x0F)
 
 AD7124_ADC_CTRL_REG = 0x01
 AD7124_ADC_CTRL_REG_DOUT_RDY_DEL = 1 << 12
@@ -27,6 +55,15 @@ AD7124_ADC_CTRL_REG_REF_EN = 1 << 8
 AD7124_ADC_CTRL_REG_POWER_MODE = lambda x : (x & 0x03) << 6
 AD7124_ADC_CTRL_REG_MODE = lambda x : (x & 0x0F) << 2
 AD7124_ADC_CTRL_REG_CLK_SEL = lambda x : (x & 0x03)
+AD7124_POWER_MODE_LOW = 0
+AD7124_POWER_MODE_MID = 1
+AD7124_POWER_MODE_FULL = 3
+AD7124_MODE_CONTINUOUS = 0
+AD7124_MODE_IDLE = 4
+AD7124_MODE_INTERNAL_ZERO_SCALE = 5
+AD7124_MODE_INTERNAL_FULL_SCALE = 6
+AD7124_MODE_SYSTEM_ZERO_SCALE = 7
+AD7124_MODE_SYSTEM_FULL_SCALE = 8
 
 AD7124_DATA_REG = 0x02
 
@@ -45,10 +82,24 @@ AD7124_IO_CTRL1_REG_IOUT0 = lambda x : (x & 0x07) << 8
 AD7124_IO_CTRL1_REG_IOUT1_CH = lambda x : (x & 0x0F) << 4
 AD7124_IO_CTRL1_REG_IOUT0_CH = lambda x : (x & 0x0F)
 
+# Excitation current in µA to IOUTx register bits
+AD7124_IOUT_CURRENT_BITS = {0: 0b000, 50: 0b001, 100: 0b010, 250: 0b011, 500: 0b100, 750: 0b101, 1000: 0b110, 0.1: 0b111}
+
 AD7124_IO_CTRL2_REG = 0x04
 
 AD7124_ID_REG = 0x05
 AD7124_ERR_REG = 0x06
+AD7124_ERR_REG_SPI_IGNORE_ERR = 1 << 6
+AD7124_ERR_REG_SPI_SCLK_CNT_ERR = 1 << 5
+AD7124_ERR_REG_SPI_READ_ERR = 1 << 4
+AD7124_ERR_REG_SPI_WRITE_ERR = 1 << 3
+AD7124_ERR_REG_SPI_CRC_ERR = 1 << 2
+# Errors after which the last register write may not have taken effect
+AD7124_ERR_REG_SPI_WRITE_ERRORS = AD7124_ERR_REG_SPI_SCLK_CNT_ERR | AD7124_ERR_REG_SPI_WRITE_ERR | AD7124_ERR_REG_SPI_CRC_ERR
+
+AD7124_ERR_EN_REG = 0x07
+AD7124_ERR_EN_REG_SPI_CRC_ERR_EN = 1 << 2
+AD7124_MCLK_COUNT_REG = 0x08
 
 AD7124_CH0_MAP_REG = 0x09
 AD7124_CH1_MAP_REG = 0x0A
@@ -73,6 +124,13 @@ AD7124_CH_MAP_REG_AINP = lambda x : (x & 0x1F) << 5
 AD7124_CH_MAP_REG_AINM = lambda x : (x & 0x1F)
 
 AD7124_CFG0_REG = 0x19
+AD7124_CFG1_REG = 0x1A
+AD7124_CFG2_REG = 0x1B
+AD7124_CFG3_REG = 0x1C
+AD7124_CFG4_REG = 0x1D
+AD7124_CFG5_REG = 0x1E
+AD7124_CFG6_REG = 0x1F
+AD7124_CFG7_REG = 0x20
 AD7124_CFG_REG_BIPOLAR = 1 << 11
 AD7124_CFG_REG_BURNOUT = lambda x : (x & 0x03) << 9
 AD7124_CFG_REG_REF_BUFP = 1 << 8
@@ -82,56 +140,293 @@ AD7124_CFG_REG_AIN_BUFM = 1 << 5
 AD7124_CFG_REG_REF_SEL = lambda x : (x & 0x03) << 3
 AD7124_CFG_REG_PGA = lambda x : (x & 0x07)
 
+AD7124_FILTER0_REG = 0x21
+AD7124_FILTER_REG_FILTER = lambda x : (x & 0x07) << 21
+AD7124_FILTER_REG_REJ60 = 1 << 20
+AD7124_FILTER_REG_POST_FILTER = lambda x : (x & 0x07) << 17
+AD7124_FILTER_REG_SINGLE_CYCLE = 1 << 16
+AD7124_FILTER_REG_FS = lambda x : (x & 0x7FF)
+AD7124_FILTER_SINC4 = 0
+AD7124_FILTER_SINC3 = 2
+AD7124_FILTER_FAST_SINC4 = 4
+AD7124_FILTER_FAST_SINC3 = 5
+AD7124_FILTER_POST = 7
+
+AD7124_OFFSET0_REG = 0x29
+AD7124_GAIN0_REG = 0x31
+AD7124_OFFSET_DEFAULT = 0x800000
+
+AD7124_REG_SIZE = {
+    AD7124_STATUS_REG: 1,
+    AD7124_ADC_CTRL_REG: 2,
+    AD7124_DATA_REG: 3,
+    AD7124_IO_CTRL1_REG: 3,
+    AD7124_IO_CTRL2_REG: 2,
+    AD7124_ID_REG: 1,
+    AD7124_ERR_REG: 3,
+    AD7124_ERR_EN_REG: 3,
+    AD7124_MCLK_COUNT_REG: 1,
+} | {reg: 2 for reg in range(AD7124_CH0_MAP_REG, AD7124_CH15_MAP_REG + 1)} \
+  | {reg: 2 for reg in range(AD7124_CFG0_REG, AD7124_CFG7_REG + 1)} \
+  | {reg: 3 for reg in range(AD7124_FILTER0_REG, AD7124_FILTER0_REG + 8)} \
+  | {reg: 3 for reg in range(AD7124_OFFSET0_REG, AD7124_OFFSET0_REG + 8)} \
+  | {reg: 3 for reg in range(AD7124_GAIN0_REG, AD7124_GAIN0_REG + 8)}
+
+# Comms bytes for every register address, built once instead of per access
+AD7124_READ_COMMANDS = tuple(AD7124_COMMS_REG | AD7124_COMM_REG_WEN | AD7124_COMM_REG_RD | AD7124_COMM_REG_RA(reg) for reg in range(0x40))
+AD7124_WRITE_COMMANDS = tuple(AD7124_COMMS_REG | AD7124_COMM_REG_WEN | AD7124_COMM_REG_WR | AD7124_COMM_REG_RA(reg) for reg in range(0x40))
+
+# CRC-8 with polynomial x^8 + x^2 + x + 1, one table lookup per byte
+AD7124_CRC8_POLYNOMIAL = 0x07
+
+
+def _crc8_entry(byte):
+    crc = byte
+    for _ in range(8):
+        crc = ((crc << 1) ^ AD7124_CRC8_POLYNOMIAL) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+AD7124_CRC8_TABLE = tuple(_crc8_entry(byte) for byte in range(256))
+
+
+def crc8(data, crc=0):
+    for byte in data:
+        crc = AD7124_CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+class CRCError(OSError):
+    pass
+
+
+# Registers whose contents change without being written; never shadowed
+AD7124_VOLATILE_REGS = (AD7124_STATUS_REG, AD7124_DATA_REG, AD7124_ERR_REG, AD7124_MCLK_COUNT_REG)
+
+
+@dataclass(frozen=True)
+class Setup:
+    gain: int = 1
+    filter_type: int = AD7124_FILTER_SINC4
+    fs: int = 384
+    rej60: bool = False
+    post_filter: int = 3
+    single_cycle: bool = False
+
+
+@dataclass(frozen=True)
+class Channel:
+    ainp: int
+    ainm: int
+    setup: int = 0
+
+
+class _StreamPacer:
+    # Times speculative continuous-read frames when there is no DOUT/RDY line.
+    # It keeps lower bounds on the conversion period and on the time of the
+    # last conversion read, and wakes a little after the next one is due, so
+    # most frames find a sample. Every bound only errs early: waking early
+    # costs a stale frame, waking late could skip a conversion.
+    def __init__(self, poll_interval):
+        self.poll_interval = poll_interval
+        self.max_interval = AD7124_READY_POLL_MAX_INTERVAL
+        self.period = None
+        self.anchor = None
+        # (read time, index) of the last sample caught arriving while polling
+        self.polled = None
+
+    def sleep(self):
+        if self.period is None or self.anchor is None:
+            return
+        delay = self.anchor + self.period * (1 + AD7124_STREAM_MARGIN) - time.monotonic()
+        # Shorter sleeps cost more than the frame they would save
+        if delay > self.poll_interval:
+            time.sleep(delay)
+
+    def update(self, probes, index):
+        # probes holds the time of every frame clocked for sample `index`
+        if self.anchor is not None and self.period is not None:
+            if probes[0] >= self.anchor + 2 * self.period:
+                # Woken late enough to have skipped a conversion, so the next
+                # period bound must not count samples across this one
+                self.polled = None
+            due = self.anchor + self.period
+        else:
+            due = None
+        if len(probes) == 1:
+            # Found waiting: converted at least a period after the last one
+            self.anchor = due
+            return
+
+        stale, found = probes[-2], probes[-1]
+        self.anchor = stale
+        if self.polled is not None:
+            # The last caught sample converted before it was read and this one
+            # after the stale frame before it. Unless a conversion was skipped
+            # in between, that bounds the period from below; a poll step can
+            # only skip one if it is longer than the period, which requiring
+            # twice the step rules out.
+            bound = (stale - self.polled[0]) / (index - self.polled[1])
+            if bound >= 2 * (found - stale):
+                self.period = bound if self.period is None else max(self.period, bound)
+            # Short enough steps for the next bound to count
+            self.max_interval = min(AD7124_READY_POLL_MAX_INTERVAL, bound / 4)
+        self.polled = (found, index)
+
 
 class AD7124:
-    def __init__(self, device=0):
-        self.spi = spidev.SpiDev()
+    def __init__(self, device=0, data_ready=None, ready_timeout=AD7124_READY_TIMEOUT, spi=None, metrics=None,
+                 crc=False, max_speed_hz=AD7124_SPI_MAX_SPEED, bus=AD7124_SPI_BUS, poll_interval=AD7124_READY_POLL_INTERVAL):
+        # Any object with spidev's open/close/xfer2/mode/max_speed_hz interface
+        # can stand in for the SPI device, e.g. simulator.SimulatedAD7124.
+        if spi is None:
+            if spidev is None:
+                raise ImportError("spidev is required to talk to an AD7124 over SPI")
+            spi = spidev.SpiDev()
+        self.spi = spi
+        self.spi_bus = bus
         self.spi_device = device
+        # Identifies the chip in stored samples and caches; on bus 0 it is
+        # just the chip select
+        self.source = (bus << 4) | device
+        # Optional callable returning True while DOUT/RDY is low (e.g. a GPIO
+        # wired to MISO). When unset, the RDY bit of the status register is polled.
+        self.data_ready = data_ready
+        self.ready_timeout = ready_timeout
+        # First wait between RDY polls; 0 polls back to back, e.g. when replaying a trace
+        self.poll_interval = poll_interval
+        self._shadow = {}
+        self.channel_map = {}
+        # Optional sample store fed with every conversion result (see store.SampleStore)
+        self.sink = None
+        # Optional metrics.Metrics collector; instrumentation is skipped entirely when unset
+        self.metrics = metrics
+        self._bus_lock = AD7124_BUS_LOCKS.setdefault(bus, threading.Lock())
+        # CRC checking is requested with `crc` and switched on by initialize();
+        # a reset turns it off on the chip, and _crc tracks the chip's state.
+        self.crc = crc
+        self._crc = False
+        self.max_speed_hz = max_speed_hz
+        # Last ERR register value read because of a set ERROR_FLAG
+        self.last_error = 0
+        self._build_transfers()
+        
+    def _build_transfers(self):
+        # Prebuilt transfers for the per-sample path; xfer2 does not modify them
+        crc = [0x00] if self._crc else []
+        self._status_tx = [AD7124_READ_COMMANDS[AD7124_STATUS_REG], 0x00] + crc
+        self._data_tx = [AD7124_READ_COMMANDS[AD7124_DATA_REG], 0x00, 0x00, 0x00, 0x00] + crc
+        self._stream_tx = [0x00, 0x00, 0x00, 0x00] + crc
         
     def connect(self):
-        self.spi.open(AD7124_SPI_BUS, self.spi_device)
+        self.spi.open(self.spi_bus, self.spi_device)
         self.spi.mode = AD7124_SPI_MODE
-        self.spi.max_speed_hz = AD7124_SPI_MAX_SPEED
+        self.spi.max_speed_hz = self.max_speed_hz
         
     def close(self):
         self.spi.close()
         
     def initialize(self):
         self.reset()
+        if self.crc:
+            self.enable_crc()
         
     def reset(self):
-        self.spi.xfer2([0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF])
+        self._xfer([0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF], "reset")
+        self._shadow.clear()
+        if self._crc:
+            self._crc = False
+            self._build_transfers()
         logger.debug("Reset complete")
         
+    def enable_crc(self, enabled=True):
+        # Every transfer after this write carries a CRC byte: appended by the
+        # host on writes and by the chip on reads.
+        err_en = self._read_register(AD7124_ERR_EN_REG)
+        if enabled:
+            err_en |= AD7124_ERR_EN_REG_SPI_CRC_ERR_EN
+        else:
+            err_en &= ~AD7124_ERR_EN_REG_SPI_CRC_ERR_EN
+        self._write_register(AD7124_ERR_EN_REG, err_en)
+        self._crc = enabled
+        self._build_transfers()
+        logger.debug("SPI CRC %s", "enabled" if enabled else "disabled")
+        
+    def read_error(self):
+        # Reading ERR clears its SPI error bits. Those mean a write may have
+        # been rejected, so the shadow can no longer be trusted.
+        error_reg = self._read_registers([AD7124_ERR_REG])[AD7124_ERR_REG]
+        if error_reg & AD7124_ERR_REG_SPI_WRITE_ERRORS:
+            self._shadow.clear()
+        self.last_error = error_reg
+        
+        return error_reg
+        
+    def calibrate_spi_speed(self, speeds=AD7124_SPI_SPEEDS, reads=AD7124_SPI_CALIBRATION_READS):
+        # Steps the SPI clock up through `speeds` with CRC enabled, reading the
+        # ID and setup registers back `reads` times at each rate, and keeps the
+        # fastest rate at which every readback passed its CRC and matched.
+        self.initialize()
+        if not self._crc:
+            self.enable_crc()
+        regs = [AD7124_ID_REG, AD7124_ERR_EN_REG] + list(range(AD7124_CFG0_REG, AD7124_FILTER0_REG + 8))
+        self.spi.max_speed_hz = speeds[0]
+        expected = self._read_registers(regs)
+        
+        best = speeds[0]
+        for speed in speeds[1:]:
+            self.spi.max_speed_hz = speed
+            try:
+                for _ in range(reads):
+                    if self._read_registers(regs) != expected:
+                        raise CRCError("Readback mismatch at {} Hz".format(speed))
+            except CRCError as e:
+                logger.info("Device %s SPI unreliable at %s Hz: %s", self.spi_device, speed, e)
+                break
+            best = speed
+        
+        self.max_speed_hz = best
+        self.spi.max_speed_hz = best
+        self.read_error()
+        logger.info("Device %s SPI clock set to %s Hz", self.spi_device, best)
+        
+        return best
+        
     def read_status(self):
-        comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN | AD7124_COMM_REG_RD | AD7124_COMM_REG_RA(AD7124_STATUS_REG)
-        response = self.spi.xfer2([comms_write, 0x00])
-        status_register = response[-1] & 0xFF
-        logger.debug("Status Register: 0x{:02X}".format(status_register))
-        if (status_register & 0x80) >> 7 == 1:
+        status_register = self._read_register(AD7124_STATUS_REG)
+        logger.debug("Status Register: 0x%02X", status_register)
+        if status_register & AD7124_STATUS_REG_RDY:
             logger.debug("ADC is not ready for conversion")
-        logger.debug("Channel {} Converted".format(status_register & 0x0F))
+        logger.debug("Channel %s Converted", AD7124_STATUS_REG_CH_ACTIVE(status_register))
         
         return status_register
         
-    def read_id(self):
-        command = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_RD | AD7124_COMM_REG_RA(AD7124_ID_REG)
-        response = self.spi.xfer2([AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_RD | AD7124_COMM_REG_RA(AD7124_ID_REG), 0x00])
-        id_register = response[-1]
+    def read_id(self, refresh=False):
+        id_register = self._read_register(AD7124_ID_REG, refresh)
         device_id = (id_register >> 4) & 0x0F
         silicon_rev = id_register & 0x0F
-        logger.info("ID Register: 0x{:02X}".format(id_register))
-        logger.debug("Device ID: {}".format(device_id))
-        logger.debug("Silicon Revision: {}".format(silicon_rev))
+        logger.info("ID Register: 0x%02X", id_register)
+        logger.debug("Device ID: %s", device_id)
+        logger.debug("Silicon Revision: %s", silicon_rev)
         
         return id_register, device_id, silicon_rev
     
-    def configure(self):
+    def configure(self, setups=None, channels=None):
+        # setups maps slot (0-7) to Setup and channels maps channel (0-15) to
+        # Channel. Setups are written once here; channels stay disabled until
+        # scan() enables them, and each converts with its own setup.
         self.set_adc_config()
-        self.set_channel_config()
+        if setups is None:
+            self.set_channel_config()
+            return
+        
+        for slot, setup in setups.items():
+            self.set_config(gain=setup.gain, cfg_channel=slot)
+            self.set_filter(setup=slot, filter_type=setup.filter_type, fs=setup.fs, rej60=setup.rej60,
+                            post_filter=setup.post_filter, single_cycle=setup.single_cycle)
+        self.channel_map = dict(channels or {})
         
     def set_config(self, gain, cfg_channel=0):
-        comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_WR | AD7124_COMM_REG_RA(AD7124_CFG0_REG)
         match gain:
             case 1:
                 gain_bits = 0b000
@@ -153,128 +448,529 @@ class AD7124:
                 logger.error("Invalid gain specified, defaulting to 1")
                 gain_bits = 0b000
         config_reg = AD7124_CFG_REG_BIPOLAR | AD7124_CFG_REG_AIN_BUFP | AD7124_CFG_REG_AIN_BUFM | AD7124_CFG_REG_REF_SEL(0) | AD7124_CFG_REG_PGA(gain_bits)
-        self.spi.xfer2([comms_write, (config_reg >> 8) & 0xFF, config_reg & 0xFF])
-        logger.debug("Configuration Register {} set to: 0x{:04X}".format(cfg_channel, config_reg))
+        config_reg_addr = self._setup_register(AD7124_CFG0_REG, cfg_channel)
+        if config_reg_addr is None:
+            return
+        if self._write_register(config_reg_addr, config_reg):
+            logger.debug("Configuration Register %s set to: 0x%04X", cfg_channel, config_reg)
         
-    def read_config(self, cfg_channel=0):
-        comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_RD | AD7124_COMM_REG_RA(AD7124_CFG0_REG)
-        response = self.spi.xfer2([comms_write, 0x00, 0x00])
-        config_reg = (response[-2] << 8) | response[-1]
-        logger.debug("Configuration Register {}: 0x{:04X}".format(cfg_channel, config_reg))
+    def read_config(self, cfg_channel=0, refresh=False):
+        config_reg_addr = self._setup_register(AD7124_CFG0_REG, cfg_channel)
+        if config_reg_addr is None:
+            return None
+        config_reg = self._read_register(config_reg_addr, refresh)
+        logger.debug("Configuration Register %s: 0x%04X", cfg_channel, config_reg)
         
         return config_reg
     
-    def set_adc_config(self):
-        comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_WR | AD7124_COMM_REG_RA(AD7124_ADC_CTRL_REG)
-        adc_config = AD7124_ADC_CTRL_REG_DOUT_RDY_DEL | AD7124_ADC_CTRL_REG_DATA_STATUS | AD7124_ADC_CTRL_REG_REF_EN | AD7124_ADC_CTRL_REG_POWER_MODE(3) | AD7124_ADC_CTRL_REG_MODE(0) | AD7124_ADC_CTRL_REG_CLK_SEL(0)
+    def set_filter(self, setup=0, filter_type=AD7124_FILTER_SINC4, fs=384, rej60=False, post_filter=3, single_cycle=False):
+        filter_reg = AD7124_FILTER_REG_FILTER(filter_type) | AD7124_FILTER_REG_POST_FILTER(post_filter) | AD7124_FILTER_REG_FS(fs)
+        if rej60:
+            filter_reg |= AD7124_FILTER_REG_REJ60
+        if single_cycle:
+            filter_reg |= AD7124_FILTER_REG_SINGLE_CYCLE
+        filter_reg_addr = self._setup_register(AD7124_FILTER0_REG, setup)
+        if filter_reg_addr is None:
+            return
+        if self._write_register(filter_reg_addr, filter_reg):
+            logger.debug("Filter Register %s set to: 0x%06X", setup, filter_reg)
+    
+    def read_filter(self, setup=0, refresh=False):
+        filter_reg_addr = self._setup_register(AD7124_FILTER0_REG, setup)
+        if filter_reg_addr is None:
+            return None
+        filter_reg = self._read_register(filter_reg_addr, refresh)
+        logger.debug("Filter Register %s: 0x%06X", setup, filter_reg)
+        
+        return filter_reg
+    
+    def set_adc_config(self, cont_read=False, mode=AD7124_MODE_CONTINUOUS, power_mode=AD7124_POWER_MODE_FULL):
+        adc_config = AD7124_ADC_CTRL_REG_DOUT_RDY_DEL | AD7124_ADC_CTRL_REG_DATA_STATUS | AD7124_ADC_CTRL_REG_REF_EN | AD7124_ADC_CTRL_REG_POWER_MODE(power_mode) | AD7124_ADC_CTRL_REG_MODE(mode) | AD7124_ADC_CTRL_REG_CLK_SEL(0)
+        if cont_read:
+            adc_config |= AD7124_ADC_CTRL_REG_CONT_READ
         # adc_config = AD7124_ADC_CTRL_REG_REF_EN | AD7124_ADC_CTRL_REG_POWER_MODE(3) | AD7124_ADC_CTRL_REG_MODE(1) | AD7124_ADC_CTRL_REG_CLK_SEL(0)
-        self.spi.xfer2([comms_write, (adc_config >> 8) & 0xFF, adc_config & 0xFF])
-        logger.debug("ADC Configured: 0x{:04X}".format(adc_config))
+        if self._write_register(AD7124_ADC_CTRL_REG, adc_config):
+            logger.debug("ADC Configured: 0x%04X", adc_config)
+        
+    def read_adc_config(self, refresh=False):
+        adc_control_reg = self._read_register(AD7124_ADC_CTRL_REG, refresh)
+        logger.debug("ADC Configuration: 0x%04X", adc_control_reg)
         
-    def read_adc_config(self):
-        comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_RD | AD7124_COMM_REG_RA(AD7124_ADC_CTRL_REG)
-        response = self.spi.xfer2([comms_write, 0x00, 0x00])
-        adc_control_reg = response[-2] << 8 | response[-1]
-        logger.debug("ADC Configuration: 0x{:04X}".format(adc_control_reg))
+        return adc_control_reg
         
     def set_channel_config(self, disable=False, channel=0, setup=0, ainp=16, ainm=17):
         channel_reg = self._channel_selector(channel)
-        comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_WR | AD7124_COMM_REG_RA(channel_reg)
         if disable:
             channel_config = 1
         else:
-            channel_config = AD7124_CH_MAP_REG_CH_ENABLE | AD7124_CH_MAP_REG_SETUP(0) | AD7124_CH_MAP_REG_AINP(ainp) | AD7124_CH_MAP_REG_AINM(ainm)
-        self.spi.xfer2([comms_write, (channel_config >> 8) & 0xFF, channel_config & 0xFF])
-        logger.debug("Channel {} Configured: 0x{:04X}".format(channel, channel_config))
+            channel_config = AD7124_CH_MAP_REG_CH_ENABLE | AD7124_CH_MAP_REG_SETUP(setup) | AD7124_CH_MAP_REG_AINP(ainp) | AD7124_CH_MAP_REG_AINM(ainm)
+        if self._write_register(channel_reg, channel_config):
+            logger.debug("Channel %s Configured: 0x%04X", channel, channel_config)
     
-    def read_channel_config(self, channel=0):
+    def read_channel_config(self, channel=0, refresh=False):
         channel_reg = self._channel_selector(channel)
-        comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_RD | AD7124_COMM_REG_RA(channel_reg)
-        response = self.spi.xfer2([comms_write, 0x00, 0x00])
-        channel_config_reg = response[-2] << 8 | response[-1]
-        logger.debug("Channel {} Configuration: 0x{:04X}".format(channel, channel_config_reg))
-        
-    def read_data(self):
-        time.sleep(0.1)
-        comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN | AD7124_COMM_REG_RD | AD7124_COMM_REG_RA(AD7124_DATA_REG)
-        # data_reg = self.spi.xfer2([comms_write, 0x00, 0x00, 0x00])
-        # data = (data_reg[-3] << 16) | (data_reg[-2] << 8) | data_reg[-1]
-        data_reg = self.spi.xfer2([comms_write, 0x00, 0x00, 0x00, 0x00])
-        data = (data_reg[-4] << 16) | (data_reg[-3] << 8) | data_reg[-2]
-        status = data_reg[-1] & 0xFF
-        logger.debug("Data Register: 0x{:06X}".format(data))
-        logger.debug("\tStatus Register: 0x{:02X}".format(status))
+        channel_config_reg = self._read_register(channel_reg, refresh)
+        logger.debug("Channel %s Configuration: 0x%04X", channel, channel_config_reg)
+        
+        return channel_config_reg
+        
+    def wait_ready(self, timeout=None, poll_interval=None,
+                   max_interval=AD7124_READY_POLL_MAX_INTERVAL, backoff=AD7124_READY_POLL_BACKOFF):
+        if self.metrics is None:
+            self._poll(self._conversion_ready, timeout, poll_interval, max_interval, backoff)
+            return
+        start = time.perf_counter()
+        self._poll(self._conversion_ready, timeout, poll_interval, max_interval, backoff)
+        self.metrics.record_ready_wait(time.perf_counter() - start)
+    
+    def _poll(self, probe, timeout=None, poll_interval=None,
+              max_interval=AD7124_READY_POLL_MAX_INTERVAL, backoff=AD7124_READY_POLL_BACKOFF):
+        if timeout is None:
+            timeout = self.ready_timeout
+        deadline = time.monotonic() + timeout
+        interval = self.poll_interval if poll_interval is None else poll_interval
+        while not (result := probe()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error("Conversion not ready after %.3f s", timeout)
+                if self.metrics is not None:
+                    self.metrics.record_timeout()
+                raise TimeoutError("AD7124 conversion not ready after {:.3f} s".format(timeout))
+            time.sleep(min(interval, remaining))
+            interval = min(interval * backoff, max_interval)
+        
+        return result
+    
+    def _conversion_ready(self):
+        if self.data_ready is not None:
+            return self.data_ready()
+        response = self._xfer(self._status_tx)
+        if self._crc:
+            self._check_crc(self._status_tx[0], response)
+        return not response[1] & AD7124_STATUS_REG_RDY
+        
+    def read_data(self, timeout=None):
+        data, status = self.read_data_raw(timeout)
+        
+        return self._deliver(data, status)
+    
+    def read_data_nowait(self):
+        # Reads the data register without waiting; the RDY bit of the appended
+        # status byte tells a new conversion from a repeat of the last one, in
+        # which case None is returned. One transfer either way.
+        result = self._read_ready()
+        if result is None:
+            return None
+        
+        return self._deliver(*result)
+    
+    def _read_ready(self):
+        # (code, status) of a new conversion, or None; nothing is logged or
+        # recorded here. With a data_ready line no transfer is made until it
+        # is low.
+        if self.data_ready is not None and not self.data_ready():
+            return None
+        data_reg = self._xfer(self._data_tx)
+        if self._crc:
+            self._check_crc(self._data_tx[0], data_reg)
+        if data_reg[4] & AD7124_STATUS_REG_RDY:
+            return None
+        
+        return (data_reg[1] << 16) | (data_reg[2] << 8) | data_reg[3], data_reg[4]
+    
+    def _deliver(self, data, status):
+        logger.debug("Data Register: 0x%06X", data)
+        logger.debug("\tStatus Register: 0x%02X", status)
+        if status & AD7124_STATUS_REG_ERROR_FLAG:
+            # The status byte comes with every sample, so ERR is only read
+            # when it actually flags something
+            logger.warning("Device %s error register: 0x%06X", self.spi_device, self.read_error())
+            if self.metrics is not None:
+                self.metrics.record_error()
+        if self.sink is not None:
+            self.sink.append(self.source, data, status)
         
         return data, status
     
+    def read_data_raw(self, timeout=None):
+        # The status byte arrives with the data (DATA_STATUS), so the data
+        # register itself is polled: a sample that is already waiting costs
+        # one transfer and no status register read.
+        if self.metrics is None:
+            return self._poll(self._read_ready, timeout)
+        start = time.perf_counter()
+        result = self._poll(self._read_ready, timeout)
+        self.metrics.record_ready_wait(time.perf_counter() - start)
+        
+        return result
+    
+    def read_raw_into(self, codes, statuses=None, timeout=None):
+        # Fills preallocated sequences, e.g. array('i') and array('B'), in place
+        poll = self._poll
+        read_ready = self._read_ready
+        for i in range(len(codes)):
+            codes[i], status = poll(read_ready, timeout)
+            if statuses is not None:
+                statuses[i] = status
+        
+        return len(codes)
+    
+    def scan(self, channels, setup=0, timeout=None):
+        # All requested channel maps are enabled together so the ADC sequences
+        # through them on its own; each sample is attributed to its channel by
+        # the status byte appended to the data register (DATA_STATUS).
+        # channels is either {channel: (ainp, ainm)} converted with `setup`, or
+        # channel numbers from the map given to configure().
+        start = time.perf_counter()
+        if not isinstance(channels, dict):
+            channels = {channel: self.channel_map[channel] for channel in channels}
+        for channel, mapping in channels.items():
+            if not isinstance(mapping, Channel):
+                mapping = Channel(*mapping, setup=setup)
+            self.set_channel_config(channel=channel, setup=mapping.setup, ainp=mapping.ainp, ainm=mapping.ainm)
+        
+        results = {}
+        while len(results) < len(channels):
+            data, status = self.read_data(timeout)
+            channel = AD7124_STATUS_REG_CH_ACTIVE(status)
+            if channel in channels and channel not in results:
+                results[channel] = (data, status)
+            else:
+                logger.debug("Discarding sample from channel %s", channel)
+        
+        for channel in channels:
+            self.set_channel_config(channel=channel, disable=True)
+        
+        if self.metrics is not None:
+            self.metrics.record_scan(time.perf_counter() - start)
+        
+        return results
+    
+    def stream(self, count=None, timeout=None):
+        # In continuous read mode the data register is clocked out directly,
+        # without a comms byte, every time DOUT/RDY goes low. This is meant
+        # for a data_ready line (a GPIO on DOUT/RDY, see async_ad7124): the
+        # status register cannot be polled in this mode, so without one every
+        # probe clocks a whole frame. In that case _StreamPacer times the
+        # frames from the conversion period measured between samples. That is
+        # not lossless: a frame clocked after the next conversion has replaced
+        # the one due loses it, and host sleeps can overshoot by a millisecond
+        # or more. In the simulator about 1 in 200 to 1000 conversions went
+        # missing at FS 24 to 192; use a data_ready line where every one counts.
+        # Waiting on the status register beforehand would not help: entering
+        # the mode is an ADC_CONTROL write, which restarts the conversion.
+        pacer = _StreamPacer(self.poll_interval) if self.data_ready is None else None
+        self.set_adc_config(cont_read=True)
+        try:
+            samples = 0
+            while count is None or samples < count:
+                if pacer is None:
+                    data, status = self._poll(self._read_continuous, timeout)
+                else:
+                    pacer.sleep()
+                    probes = []
+                    
+                    def probe():
+                        probes.append(time.monotonic())
+                        return self._read_continuous()
+                    
+                    data, status = self._poll(probe, timeout, max_interval=pacer.max_interval)
+                    pacer.update(probes, samples)
+                if self.sink is not None:
+                    self.sink.append(self.source, data, status)
+                yield AD7124_STATUS_REG_CH_ACTIVE(status), data, status
+                samples += 1
+        finally:
+            self._exit_continuous_read(timeout, pacer)
+    
+    def _read_continuous(self):
+        if self.data_ready is not None and not self.data_ready():
+            return None
+        frame = self._xfer(self._stream_tx, "stream")
+        if self._crc:
+            # There is no comms byte; the CRC is seeded as if the read data
+            # command had been sent
+            self._check_crc(AD7124_READ_COMMANDS[AD7124_DATA_REG], [0x00] + frame)
+        status = frame[3]
+        # Without a DOUT/RDY line the frame is clocked speculatively; a set RDY
+        # bit in the trailing status byte marks it as a repeat of the last sample.
+        if status & AD7124_STATUS_REG_RDY:
+            return None
+        data = (frame[0] << 16) | (frame[1] << 8) | frame[2]
+        logger.debug("Continuous Data: 0x%06X Status: 0x%02X", data, status)
+        
+        return data, status
+    
+    def _exit_continuous_read(self, timeout=None, pacer=None):
+        # Continuous read is left by clocking a read data command while
+        # DOUT/RDY is low. Sent at any other time it is taken as part of a
+        # frame and the chip keeps streaming, so without a data_ready line it
+        # is timed by the pacer like a frame, and every attempt is confirmed by
+        # reading ADC_CONTROL back. While the chip still streams that readback
+        # is frame bytes, which fail the comparison or the CRC.
+        streaming = self._shadow[AD7124_ADC_CTRL_REG]
+        exit_tx = [AD7124_READ_COMMANDS[AD7124_DATA_REG]] + [0x00] * (len(self._stream_tx))
+        
+        def exit_command():
+            if self.data_ready is not None:
+                if not self.data_ready():
+                    return False
+            elif pacer is not None:
+                pacer.sleep()
+            # The conversion comes back as a normal read; it is dropped
+            self._xfer(exit_tx, "stream")
+            self._shadow.pop(AD7124_ADC_CTRL_REG, None)
+            try:
+                adc_control = self._read_register(AD7124_ADC_CTRL_REG, refresh=True)
+            except CRCError:
+                adc_control = None
+            if adc_control != streaming & ~AD7124_ADC_CTRL_REG_CONT_READ:
+                self._shadow[AD7124_ADC_CTRL_REG] = streaming
+                return False
+            return True
+        
+        self._poll(exit_command, timeout)
+        self.set_adc_config()
+        logger.debug("Continuous read mode exited")
+    
+    def calibrate(self, mode, setup=0, channel=0, ainp=16, ainm=17, timeout=AD7124_CALIBRATION_TIMEOUT):
+        # Runs one calibration (AD7124_MODE_*_SCALE) of `setup` through
+        # `channel`, which is the only one enabled meanwhile. Internal modes
+        # short or reference the inputs themselves; system modes expect the
+        # zero- or full-scale signal to be applied to ainp/ainm. Calibration is
+        # not supported at full power, so it runs at mid power; the
+        # coefficients hold for all power modes.
+        self.set_channel_config(channel=channel, setup=setup, ainp=ainp, ainm=ainm)
+        if mode == AD7124_MODE_INTERNAL_FULL_SCALE:
+            self._write_register(AD7124_OFFSET0_REG + setup, AD7124_OFFSET_DEFAULT)
+        self.set_adc_config(mode=mode, power_mode=AD7124_POWER_MODE_MID)
+        # The chip drops to idle mode on its own once done
+        self._shadow.pop(AD7124_ADC_CTRL_REG, None)
+        try:
+            self.wait_ready(timeout)
+        finally:
+            self.set_adc_config()
+            self.set_channel_config(channel=channel, disable=True)
+        
+        offset, gain = self.read_calibration(setup, refresh=True)
+        logger.debug("Setup %s calibrated (mode %s): offset 0x%06X gain 0x%06X", setup, mode, offset, gain)
+        
+        return offset, gain
+    
+    def calibrate_internal(self, setup=0, timeout=AD7124_CALIBRATION_TIMEOUT):
+        # Full-scale first, as it needs a neutral offset; at gain 1 the
+        # factory gain coefficient is already exact and internal full-scale
+        # calibration is not supported, so only the offset is calibrated.
+        if AD7124_CFG_REG_PGA(self.read_config(setup)):
+            self.calibrate(AD7124_MODE_INTERNAL_FULL_SCALE, setup, timeout=timeout)
+        
+        return self.calibrate(AD7124_MODE_INTERNAL_ZERO_SCALE, setup, timeout=timeout)
+    
+    def read_calibration(self, setup=0, refresh=False):
+        offset_reg = self._setup_register(AD7124_OFFSET0_REG, setup)
+        if offset_reg is None:
+            return None
+        gain_reg = AD7124_GAIN0_REG + setup
+        if refresh or offset_reg not in self._shadow or gain_reg not in self._shadow:
+            values = self._read_registers([offset_reg, gain_reg])
+        else:
+            values = self._shadow
+        
+        return values[offset_reg], values[gain_reg]
+    
+    def write_calibration(self, setup, offset, gain):
+        if self._setup_register(AD7124_OFFSET0_REG, setup) is None:
+            return
+        self._write_register(AD7124_OFFSET0_REG + setup, offset)
+        self._write_register(AD7124_GAIN0_REG + setup, gain)
+        logger.debug("Setup %s calibration restored: offset 0x%06X gain 0x%06X", setup, offset, gain)
+    
     def read_die_temp(self, data):
-        die_temp = ((data - 0x800000)/13584) - 272.5
-        logger.info("Die Temperature: {:.5f} °C".format(die_temp))
+        die_temp = conversion.die_temperature(data)
+        logger.info("Die Temperature: %.5f °C", die_temp)
         
         return die_temp
     
-    def read_io_control(self, io_control=1):
+    def read_io_control(self, io_control=1, refresh=False):
         match io_control:
             case 1:
-                comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_RD | AD7124_COMM_REG_RA(AD7124_IO_CTRL1_REG)
+                io_control_reg = self._read_register(AD7124_IO_CTRL1_REG, refresh)
             case 2:
-                comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_RD | AD7124_COMM_REG_RA(AD7124_IO_CTRL2_REG)
+                io_control_reg = self._read_register(AD7124_IO_CTRL2_REG, refresh)
             case _:
                 logger.error("Invalid IO channel specified")
                 return None
         
-        response = self.spi.xfer2([comms_write, 0x00, 0x00, 0x00])
-        io_control_reg = (response[-3] << 16) | (response[-2] << 8) | response[-1]
-        logger.info("IO Control {}: 0x{:06X}".format(io_control, io_control_reg))
+        logger.info("IO Control %s: 0x%06X", io_control, io_control_reg)
         
         return io_control_reg
     
-    def set_io_control(self, iout0_ch, ex_cur, io_control=1):
+    def read_excitation(self, refresh=False):
+        # ((IOUT0 pin, µA), (IOUT1 pin, µA)) as currently programmed
+        io_control_reg = self._read_register(AD7124_IO_CTRL1_REG, refresh)
+        currents = {bits: current for current, bits in AD7124_IOUT_CURRENT_BITS.items()}
+        
+        return ((io_control_reg & 0x0F, currents[(io_control_reg >> 8) & 0x07]),
+                ((io_control_reg >> 4) & 0x0F, currents[(io_control_reg >> 11) & 0x07]))
+    
+    def set_io_control(self, iout0_ch, ex_cur, io_control=1, iout1_ch=0, iout1_cur=0):
         match io_control:
             case 1:
-                comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_WR | AD7124_COMM_REG_RA(AD7124_IO_CTRL1_REG)
+                io_control_reg = AD7124_IO_CTRL1_REG
             case 2:
-                comms_write = AD7124_COMMS_REG | AD7124_COMM_REG_WEN| AD7124_COMM_REG_WR | AD7124_COMM_REG_RA(AD7124_IO_CTRL2_REG)
+                io_control_reg = AD7124_IO_CTRL2_REG
             case _:
                 logger.error("Invalid IO channel specified")
                 return None
             
-        match ex_cur:
-            case 0:
-                ex_cur_bits = 0b000
-            case 50:
-                ex_cur_bits = 0b001
-            case 100:
-                ex_cur_bits = 0b010
-            case 250:
-                ex_cur_bits = 0b011
-            case 500:
-                ex_cur_bits = 0b100
-            case 750:
-                ex_cur_bits = 0b101
-            case 1000:
-                ex_cur_bits = 0b110
-            case 0.1:
-                ex_cur_bits = 0b111
-            case _:
-                ex_cur_bits = 0b000
+        ex_cur_bits = AD7124_IOUT_CURRENT_BITS.get(ex_cur, 0b000)
+        iout1_cur_bits = AD7124_IOUT_CURRENT_BITS.get(iout1_cur, 0b000)
         
-        io_control_config = AD7124_IO_CTRL1_REG_IOUT0(ex_cur_bits) | AD7124_IO_CTRL1_REG_IOUT0_CH(iout0_ch)
-        self.spi.xfer2([comms_write, (io_control_config >> 16) & 0xFF, (io_control_config >> 8) & 0xFF, io_control_config & 0xFF])
-        logger.debug("IO {} Configured: 0x{:04X}".format(io_control, io_control_config))
+        io_control_config = AD7124_IO_CTRL1_REG_IOUT0(ex_cur_bits) | AD7124_IO_CTRL1_REG_IOUT0_CH(iout0_ch) \
+                          | AD7124_IO_CTRL1_REG_IOUT1(iout1_cur_bits) | AD7124_IO_CTRL1_REG_IOUT1_CH(iout1_ch)
+        if self._write_register(io_control_reg, io_control_config):
+            logger.debug("IO %s Configured: 0x%04X", io_control, io_control_config)
         
-    def rtd_test_conversion(self, data):
-        resistor_rtd = ((data - 2**23) * 5.11*10**3) / (16 * 2**23)
-        logger.info("RTD Resistance: {:.2f} Ohms".format(resistor_rtd))
+    def rtd_test_conversion(self, data, gain=conversion.RTD_GAIN, r_ref=conversion.RTD_REFERENCE_RESISTOR):
+        resistor_rtd = conversion.rtd_resistance(data, gain, r_ref)
+        logger.info("RTD Resistance: %.2f Ohms", resistor_rtd)
         
         return resistor_rtd
     
-    def sd_test_conversion(self, data):
-        sd_voltage = ((data - 2**23) / 2**23) * 2.5
-        logger.info("SD Voltage: {:.5f} V".format(sd_voltage))
+    def sd_test_conversion(self, data, gain=conversion.SD_GAIN, v_ref=conversion.SD_REFERENCE_VOLTAGE):
+        sd_voltage = conversion.sd_voltage(data, gain, v_ref)
+        logger.info("SD Voltage: %.5f V", sd_voltage)
         
         return sd_voltage
     
+    def save_registers(self, path):
+        with open(path, "w") as f:
+            json.dump({"device": self.spi_device,
+                       "registers": {"0x{:02X}".format(reg): value for reg, value in self._shadow.items()}}, f, indent=4)
+        logger.debug("Saved %s shadow registers to %s", len(self._shadow), path)
+    
+    def restore_registers(self, path):
+        # Verifies the chip against a state saved by save_registers with one
+        # bulk readback, rewriting only registers that differ, and takes the
+        # state over as the shadow. False, with nothing written, if there is
+        # no usable state or it was saved from another kind of chip.
+        try:
+            with open(path) as f:
+                saved = {int(reg, 16): value for reg, value in json.load(f)["registers"].items()}
+        except FileNotFoundError:
+            logger.debug("No register state in %s", path)
+            return False
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not load register state from %s: %s", path, e)
+            return False
+        
+        # CRC checking may still be on from the process that saved the state.
+        # A single unframed read works either way and tells which framing the
+        # bulk readback needs.
+        if self._crc:
+            self._crc = False
+            self._build_transfers()
+        err_en = self._read_registers([AD7124_ERR_EN_REG])[AD7124_ERR_EN_REG]
+        if err_en & AD7124_ERR_EN_REG_SPI_CRC_ERR_EN:
+            self._crc = True
+            self._build_transfers()
+        
+        actual = self._read_registers(saved)
+        if AD7124_ID_REG in saved and actual[AD7124_ID_REG] != saved[AD7124_ID_REG]:
+            logger.warning("Register state in %s is for chip ID 0x%02X, found 0x%02X", path, saved[AD7124_ID_REG], actual[AD7124_ID_REG])
+            return False
+        
+        self._shadow = dict(actual)
+        mismatched = [reg for reg, value in saved.items() if actual[reg] != value]
+        for reg in mismatched:
+            logger.debug("Register 0x%02X is 0x%X, restoring 0x%X", reg, actual[reg], saved[reg])
+        # ERR_EN goes last: it may switch CRC checking, which changes the
+        # framing of every transfer after it
+        for reg in sorted(mismatched, key=lambda reg: reg == AD7124_ERR_EN_REG):
+            self._write_register(reg, saved[reg])
+            if reg == AD7124_ERR_EN_REG:
+                self._crc = bool(saved[reg] & AD7124_ERR_EN_REG_SPI_CRC_ERR_EN)
+                self._build_transfers()
+        logger.debug("Register state restored from %s, %s of %s registers rewritten", path, len(mismatched), len(saved))
+        
+        return True
+    
+    def resume(self, path):
+        # initialize() for a chip an earlier process may have left configured:
+        # the state in path is verified instead of resetting the chip
+        if not self.restore_registers(path):
+            self.initialize()
+        elif self.crc != self._crc:
+            self.enable_crc(self.crc)
+    
+    def _xfer(self, data, label=None):
+        if self.metrics is None:
+            with self._bus_lock:
+                return self.spi.xfer2(data)
+        
+        if label is None:
+            label = "0x{:02X}".format(AD7124_COMM_REG_RA(data[0]))
+        start = time.perf_counter()
+        try:
+            with self._bus_lock:
+                response = self.spi.xfer2(data)
+        except OSError:
+            self.metrics.record_error()
+            raise
+        self.metrics.record_xfer(label, len(data), time.perf_counter() - start)
+        
+        return response
+    
+    def _write_register(self, reg, value):
+        if self._shadow.get(reg) == value:
+            return False
+        command = [AD7124_WRITE_COMMANDS[reg], *value.to_bytes(AD7124_REG_SIZE[reg], "big")]
+        if self._crc:
+            command.append(crc8(command))
+        self._xfer(command)
+        if reg not in AD7124_VOLATILE_REGS:
+            self._shadow[reg] = value
+        
+        return True
+    
+    def _read_register(self, reg, refresh=False):
+        if not refresh and reg in self._shadow:
+            return self._shadow[reg]
+        
+        return self._read_registers([reg])[reg]
+    
+    def _read_registers(self, regs):
+        # The serial interface returns to waiting for a comms write after every
+        # register access, so any number of reads can share one transfer.
+        crc = 1 if self._crc else 0
+        command = []
+        for reg in regs:
+            command += [AD7124_READ_COMMANDS[reg]] + [0x00] * (AD7124_REG_SIZE[reg] + crc)
+        response = self._xfer(command, None if len(regs) == 1 else "bulk")
+        
+        values = {}
+        offset = 0
+        for reg in regs:
+            size = AD7124_REG_SIZE[reg]
+            if crc:
+                self._check_crc(command[offset], response[offset:offset + 2 + size])
+            values[reg] = int.from_bytes(bytes(response[offset + 1:offset + 1 + size]), "big")
+            offset += 1 + size + crc
+        # Nothing is shadowed until every register in the transfer checked out
+        for reg, value in values.items():
+            if reg not in AD7124_VOLATILE_REGS:
+                self._shadow[reg] = value
+        
+        return values
+    
+    def _check_crc(self, command, response):
+        # response is [byte clocked during the comms byte, bytes read..., CRC];
+        # the chip's CRC covers the comms byte as sent
+        if crc8(response[1:-1], AD7124_CRC8_TABLE[command]) != response[-1]:
+            if self.metrics is not None:
+                self.metrics.record_crc_error()
+            raise CRCError("AD7124 device {} CRC mismatch".format(self.spi_device))
+    
     def _channel_selector(self, channel):
         match channel:
             case 0:
@@ -312,4 +1008,13 @@ class AD7124:
             case _:
                 logger.error("Invalid channel specified")
                 return None
+    
+    def _setup_register(self, base, setup):
+        # The eight setups each have their own CONFIG, FILTER, OFFSET and GAIN
+        # register; past slot 7 base + setup lands in the next register bank
+        if not 0 <= setup <= 7:
+            logger.error("Invalid setup specified: %s", setup)
+            return None
+        
+        return base + setup
             
\ No newline at end of file
@@ -0,0 +1,145 @@
+from logging import getLogger
+import asyncio
+
+from hs_temp_sensor import ad7124
+
+try:
+    import gpiod
+    from gpiod.line import Direction, Edge, Value
+except ImportError:
+    gpiod = None
+
+logger = getLogger(__name__)
+
+RDY_CONSUMER = "hs-temp-sensor"
+
+
+class ReadyLine:
+    # A GPIO wired to DOUT/RDY, requested with falling-edge detection. The pin
+    # also toggles while data is clocked out, so an edge only means "check the
+    # level"; the status byte of the following read has the final word.
+    def __init__(self, chip, offset, consumer=RDY_CONSUMER):
+        if gpiod is None:
+            raise ImportError("gpiod is required for DOUT/RDY edge events")
+        self.offset = offset
+        self.request = gpiod.request_lines(chip, consumer=consumer, config={
+            offset: gpiod.LineSettings(direction=Direction.INPUT, edge_detection=Edge.FALLING),
+        })
+
+    def fileno(self):
+        return self.request.fd
+
+    def drain(self):
+        self.request.read_edge_events()
+
+    def ready(self):
+        return self.request.get_value(self.offset) == Value.INACTIVE
+
+    def close(self):
+        self.request.release()
+
+
+class AsyncAD7124:
+    # asyncio front end for an AD7124. Every SPI transfer runs in a worker
+    # thread via asyncio.to_thread, so the event loop never blocks on the bus;
+    # waiting for a conversion is done on the loop, either on DOUT/RDY edge
+    # events (rdy_chip/rdy_line) or by polling with non-blocking reads.
+    def __init__(self, adc, rdy_chip=None, rdy_line=None, poll_interval=ad7124.AD7124_READY_POLL_INTERVAL,
+                 max_interval=ad7124.AD7124_READY_POLL_MAX_INTERVAL, backoff=ad7124.AD7124_READY_POLL_BACKOFF):
+        self.adc = adc
+        self.poll_interval = poll_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.rdy = ReadyLine(rdy_chip, rdy_line) if rdy_line is not None else None
+        if self.rdy is not None and adc.data_ready is None:
+            # Blocking calls made through run() benefit from the GPIO as well
+            adc.data_ready = self.rdy.ready
+        self._edge = asyncio.Event()
+        self._watching = False
+
+    async def run(self, function, *args, **kwargs):
+        # Runs any blocking driver method off the event loop, e.g.
+        # await aadc.run(aadc.adc.set_io_control, iout0_ch=1, ex_cur=500)
+        return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def connect(self):
+        await self.run(self.adc.connect)
+        if self.rdy is not None and not self._watching:
+            asyncio.get_running_loop().add_reader(self.rdy.fileno(), self._on_edge)
+            self._watching = True
+
+    async def close(self):
+        if self._watching:
+            asyncio.get_running_loop().remove_reader(self.rdy.fileno())
+            self._watching = False
+        if self.rdy is not None:
+            self.rdy.close()
+        await self.run(self.adc.close)
+
+    async def initialize(self):
+        await self.run(self.adc.initialize)
+
+    async def reset(self):
+        await self.run(self.adc.reset)
+
+    async def configure(self, setups=None, channels=None):
+        await self.run(self.adc.configure, setups, channels)
+
+    async def scan(self, channels, setup=0, timeout=None):
+        return await self.run(self.adc.scan, channels, setup, timeout)
+
+    async def read_data(self, timeout=None):
+        return await self._wait(self.adc.read_data_nowait, timeout)
+
+    async def stream(self, count=None, timeout=None):
+        # Async counterpart of AD7124.stream(), yielding (channel, data, status)
+        await self.run(self.adc.set_adc_config, cont_read=True)
+        try:
+            samples = 0
+            while count is None or samples < count:
+                data, status = await self._wait(self.adc._read_continuous, timeout)
+                if self.adc.sink is not None:
+                    self.adc.sink.append(self.adc.source, data, status)
+                yield ad7124.AD7124_STATUS_REG_CH_ACTIVE(status), data, status
+                samples += 1
+        finally:
+            await self.run(self.adc._exit_continuous_read, timeout)
+
+    def _on_edge(self):
+        self.rdy.drain()
+        self._edge.set()
+
+    async def _wait(self, probe, timeout=None):
+        # Calls probe() in a worker thread until it returns a sample. With a
+        # ready line the probe only runs once DOUT/RDY is low; otherwise it is
+        # retried with the same back-off as the blocking driver.
+        if timeout is None:
+            timeout = self.adc.ready_timeout
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + timeout
+        interval = self.poll_interval
+        while True:
+            self._edge.clear()
+            if self.rdy is None or self.rdy.ready():
+                if (result := await self.run(probe)):
+                    break
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.error("Conversion not ready after %.3f s", timeout)
+                if self.adc.metrics is not None:
+                    self.adc.metrics.record_timeout()
+                raise TimeoutError("AD7124 conversion not ready after {:.3f} s".format(timeout))
+            if self._watching:
+                try:
+                    await asyncio.wait_for(self._edge.wait(), remaining)
+                except TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(interval, remaining))
+                interval = min(interval * self.backoff, self.max_interval)
+
+        if self.adc.metrics is not None:
+            self.adc.metrics.record_ready_wait(loop.time() - start)
+
+        return result
@@ -0,0 +1,172 @@
+from array import array
+from logging import getLogger
+import os
+import statistics
+import tempfile
+import time
+
+from hs_temp_sensor import ad7124, simulator, trace
+
+logger = getLogger(__name__)
+
+BENCHMARK_REPEATS = 5
+BENCHMARK_SAMPLES = 50
+
+
+def configure_single(adc):
+    adc.initialize()
+    adc.set_adc_config()
+    adc.set_config(gain=1, cfg_channel=0)
+    adc.set_channel_config(channel=0, setup=0, ainp=16, ainm=17)
+
+
+def read_data_loop(adc):
+    for _ in range(BENCHMARK_SAMPLES):
+        adc.read_data()
+    return BENCHMARK_SAMPLES
+
+
+def read_raw_loop(adc, codes=array("i", [0]) * BENCHMARK_SAMPLES, statuses=array("B", [0]) * BENCHMARK_SAMPLES):
+    return adc.read_raw_into(codes, statuses)
+
+
+def stream_loop(adc):
+    for _ in adc.stream(count=BENCHMARK_SAMPLES):
+        pass
+    return BENCHMARK_SAMPLES
+
+
+def configure_scan(adc):
+    adc.initialize()
+    adc.set_adc_config()
+    adc.set_config(gain=16, cfg_channel=0)
+    adc.set_io_control(iout0_ch=1, ex_cur=500, io_control=1)
+
+
+def scan_loop(adc):
+    adc.scan({0: (16, 17), 1: (2, 3), 2: (5, 6), 3: (9, 10), 4: (12, 13)})
+    return 5
+
+
+# name: (simulated signals, configure(adc), measure(adc) -> samples taken)
+BENCHMARKS = {
+    "read_data": (simulator.rtd_signals, configure_single, read_data_loop),
+    "read_raw": (simulator.rtd_signals, configure_single, read_raw_loop),
+    "stream": (simulator.rtd_signals, configure_single, stream_loop),
+    "scan": (simulator.rtd_signals, configure_scan, scan_loop),
+}
+
+
+def run(benchmarks=None, repeats=BENCHMARK_REPEATS, time_scale=1.0):
+    results = {}
+    for name, (signals, configure, measure) in (benchmarks or BENCHMARKS).items():
+        spi = simulator.SimulatedAD7124(signals(), time_scale=time_scale, seed=0)
+        adc = ad7124.AD7124(0, spi=spi)
+        adc.connect()
+        configure(adc)
+
+        transactions = spi.transactions
+        nbytes = spi.bytes
+        samples = 0
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            samples += measure(adc)
+            latencies.append(time.perf_counter() - start)
+        adc.close()
+
+        elapsed = sum(latencies)
+        results[name] = {
+            "samples_per_s": samples / elapsed,
+            "transactions_per_sample": (spi.transactions - transactions) / samples,
+            "bytes_per_sample": (spi.bytes - nbytes) / samples,
+            "latency_mean_ms": statistics.mean(latencies) * 1e3,
+            "latency_max_ms": max(latencies) * 1e3,
+        }
+        logger.debug("Benchmark %s: %s", name, results[name])
+
+    return results
+
+
+def replay(path, functions, repeats=BENCHMARK_REPEATS, **adc_options):
+    # functions maps the chip select each chip was recorded under to the
+    # function that produced the recording, e.g. {0: test_rtd}; every repeat
+    # replays the whole trace through it. The functions take the chip
+    # calibration options (cal_cache, recalibrate), restored from the
+    # recording for every repeat so each one takes the same path.
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cal_cache = os.path.join(directory, "calibration.json")
+        for device, function in functions.items():
+            spi = trace.ReplayTransport(path)
+            adc = ad7124.AD7124(device, spi=spi, poll_interval=0, **adc_options)
+            adc.connect()
+            transfers = len(spi)
+
+            samples = 0
+            latencies = []
+            for _ in range(repeats):
+                spi.rewind()
+                chip_cal = trace.replay_calibration(path, cal_cache)
+                start = time.perf_counter()
+                samples += len(function(adc, **chip_cal))
+                latencies.append(time.perf_counter() - start)
+            adc.close()
+
+            elapsed = sum(latencies)
+            results["replay_{}".format(device)] = {
+                "samples_per_s": samples / elapsed,
+                "transactions_per_sample": transfers * repeats / samples,
+                "bytes_per_sample": spi.bytes / samples,
+                "latency_mean_ms": statistics.mean(latencies) * 1e3,
+                "latency_max_ms": max(latencies) * 1e3,
+            }
+            logger.debug("Replay benchmark %s: %s", device, results["replay_{}".format(device)])
+
+    return results
+
+
+def round_trip(functions, runs=2, repeats=BENCHMARK_REPEATS, **adc_options):
+    # functions maps a chip select to (simulated signals, function) as for
+    # replay(). Each function is recorded against the simulator with chip
+    # calibration on, as --test runs it: the first run fills the calibration
+    # cache and later ones restore from it. Every trace must replay to the
+    # recorded results; the replays are then timed.
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cal_cache = os.path.join(directory, "calibration.json")
+        for run in range(runs):
+            path = os.path.join(directory, "trace-{}".format(run))
+            writer = trace.TraceWriter(path)
+            trace.save_calibration(path, cal_cache)
+            recorded = {}
+            for device, (signals, function) in functions.items():
+                adc = ad7124.AD7124(device, spi=trace.RecordingTransport(writer, simulator.SimulatedAD7124(signals(), time_scale=0)),
+                                    **adc_options)
+                adc.connect()
+                recorded[device] = function(adc, cal_cache=cal_cache)
+                adc.close()
+            writer.close()
+
+            for device, (signals, function) in functions.items():
+                adc = ad7124.AD7124(device, spi=trace.ReplayTransport(path), poll_interval=0, **adc_options)
+                adc.connect()
+                replayed = function(adc, **trace.replay_calibration(path, os.path.join(directory, "replay.json")))
+                adc.close()
+                if replayed != recorded[device]:
+                    raise ValueError("Run {} on device {} replayed to {} instead of {}".format(run, device, replayed, recorded[device]))
+
+            for name, result in replay(path, {device: function for device, (_, function) in functions.items()},
+                                       repeats, **adc_options).items():
+                results["{}_run{}".format(name, run)] = result
+
+    return results
+
+
+def report(results):
+    lines = ["{:<12}{:>12}{:>12}{:>12}{:>14}{:>14}".format("benchmark", "samples/s", "xfers/smp", "bytes/smp", "mean [ms]", "max [ms]")]
+    for name, result in results.items():
+        lines.append("{:<12}{:>12.1f}{:>12.2f}{:>12.2f}{:>14.3f}{:>14.3f}".format(
+            name, result["samples_per_s"], result["transactions_per_sample"], result["bytes_per_sample"],
+            result["latency_mean_ms"], result["latency_max_ms"]))
+    return "\n".join(lines)
@@ -0,0 +1,82 @@
+from dataclasses import asdict
+from logging import getLogger
+import json
+import os
+import threading
+import time
+
+logger = getLogger(__name__)
+
+CALIBRATION_CACHE = os.path.expanduser("~/.cache/hs-temp-sensor/calibration.json")
+# Coefficients older than this, or taken at a die temperature further away
+# than CALIBRATION_MAX_DRIFT, are recalibrated instead of restored
+CALIBRATION_MAX_AGE = 7 * 24 * 3600.0
+CALIBRATION_MAX_DRIFT = 5.0
+
+# Chips are usually configured in parallel and share one cache file
+_cache_lock = threading.Lock()
+
+
+def cache_key(device, chip_id, slot):
+    return "{}:0x{:02X}:{}".format(device, chip_id, slot)
+
+
+def load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring calibration cache %s: %s", path, e)
+        return {}
+
+
+def save_cache(path, cache):
+    # Written to a temporary file first so a crash never leaves a torn cache
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(cache, f, indent=4)
+    os.replace(temporary, path)
+
+
+def stale(entry, setup, now, die_temp=None, max_age=CALIBRATION_MAX_AGE, max_drift=CALIBRATION_MAX_DRIFT):
+    # Returns why a cache entry cannot be restored, or None when it can
+    if entry is None:
+        return "not cached"
+    if entry["setup"] != asdict(setup):
+        return "setup changed"
+    if now - entry["timestamp"] > max_age:
+        return "older than {:.0f} s".format(max_age)
+    if die_temp is not None and entry["die_temp"] is not None and abs(die_temp - entry["die_temp"]) > max_drift:
+        return "die temperature drifted {:.1f} °C".format(die_temp - entry["die_temp"])
+    return None
+
+
+def restore(adc, setups, path=CALIBRATION_CACHE, die_temp=None, force=False,
+            max_age=CALIBRATION_MAX_AGE, max_drift=CALIBRATION_MAX_DRIFT):
+    # Restores the OFFSET/GAIN coefficients of every setup from the cache and
+    # runs an internal calibration for those that are missing or stale.
+    # Returns the slots that were calibrated.
+    cache = load_cache(path)
+    id_reg, dev_id, silicon_rev = adc.read_id()
+    now = time.time()
+    updates = {}
+    for slot, setup in setups.items():
+        key = cache_key(adc.source, id_reg, slot)
+        entry = cache.get(key)
+        reason = "forced" if force else stale(entry, setup, now, die_temp, max_age, max_drift)
+        if reason is None:
+            adc.write_calibration(slot, entry["offset"], entry["gain"])
+            continue
+
+        logger.info("Calibrating device %s setup %s: %s", adc.spi_device, slot, reason)
+        offset, gain = adc.calibrate_internal(slot)
+        updates[key] = {"slot": slot, "setup": asdict(setup), "offset": offset, "gain": gain, "die_temp": die_temp, "timestamp": now}
+
+    if updates:
+        with _cache_lock:
+            save_cache(path, load_cache(path) | updates)
+
+    return [entry["slot"] for entry in updates.values()]
@@ -0,0 +1,38 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bipolar offset binary: code 0x800000 is zero differential input
+ADC_MIDSCALE = 2**23
+
+RTD_GAIN = 16
+RTD_REFERENCE_RESISTOR = 5.11*10**3
+SD_GAIN = 1
+SD_REFERENCE_VOLTAGE = 2.5
+DIE_TEMP_SENSITIVITY = 13584
+DIE_TEMP_OFFSET = 272.5
+
+
+def rtd_resistance(codes, gain=RTD_GAIN, r_ref=RTD_REFERENCE_RESISTOR):
+    return _offset_binary(codes, r_ref / (gain * ADC_MIDSCALE))
+
+
+def sd_voltage(codes, gain=SD_GAIN, v_ref=SD_REFERENCE_VOLTAGE):
+    return _offset_binary(codes, v_ref / (gain * ADC_MIDSCALE))
+
+
+def die_temperature(codes):
+    return _offset_binary(codes, 1 / DIE_TEMP_SENSITIVITY, -DIE_TEMP_OFFSET)
+
+
+def _offset_binary(codes, scale, offset=0.0):
+    # Scalars stay Python floats; sequences are converted in one pass, as a
+    # NumPy array when available and as array('d') otherwise.
+    if isinstance(codes, int):
+        return (codes - ADC_MIDSCALE) * scale + offset
+    if np is not None:
+        return (np.asarray(codes, dtype=np.float64) - ADC_MIDSCALE) * scale + offset
+    return array("d", [(code - ADC_MIDSCALE) * scale + offset for code in codes])
@@ -0,0 +1,134 @@
+from bisect import bisect_right
+from logging import getLogger
+import json
+import math
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = getLogger(__name__)
+
+# IEC 60751 Callendar-Van Dusen coefficients for platinum RTDs
+CVD_A = 3.9083e-3
+CVD_B = -5.775e-7
+CVD_C = -4.183e-12
+CVD_T_MIN = 73.15
+CVD_T_MAX = 873.15
+CVD_T_STEP = 0.05
+
+ZERO_CELSIUS = 273.15
+
+
+class Curve:
+    def __init__(self, values, temperatures, name=""):
+        # Breakpoints are sorted by sensor value so diode curves, which fall
+        # with temperature, index the same way as RTD curves.
+        points = sorted(zip(values, temperatures))
+        if len(points) < 2:
+            raise ValueError("Curve {} needs at least two points".format(name))
+        self.name = name
+        self.values = [value for value, _ in points]
+        self.temperatures = [temperature for _, temperature in points]
+        self.slopes = [(t1 - t0) / (v1 - v0) for v0, v1, t0, t1 in zip(self.values, self.values[1:], self.temperatures, self.temperatures[1:])]
+        if np is not None:
+            self._values = np.array(self.values)
+            self._temperatures = np.array(self.temperatures)
+
+    def __call__(self, value):
+        # Piecewise-linear lookup, O(log n) per sample; values outside the
+        # calibrated range return NaN rather than an extrapolated temperature.
+        if isinstance(value, (int, float)):
+            i = bisect_right(self.values, value) - 1
+            if i < 0 or value > self.values[-1]:
+                return math.nan
+            i = min(i, len(self.slopes) - 1)
+            return self.temperatures[i] + (value - self.values[i]) * self.slopes[i]
+        if np is not None:
+            return np.interp(np.asarray(value, dtype=np.float64), self._values, self._temperatures, left=np.nan, right=np.nan)
+        return [self(v) for v in value]
+
+    def __repr__(self):
+        return "Curve({!r}, {} points, {:.4g}-{:.4g})".format(self.name, len(self.values), self.values[0], self.values[-1])
+
+
+def callendar_van_dusen(r0=100.0, a=CVD_A, b=CVD_B, c=CVD_C, t_min=CVD_T_MIN, t_max=CVD_T_MAX, step=CVD_T_STEP, name="cvd"):
+    # The resistance equation has no closed-form inverse below 0 °C, so it is
+    # tabulated densely once and inverted by interpolation.
+    count = int(round((t_max - t_min) / step)) + 1
+    temperatures = [t_min + i * step for i in range(count)]
+    resistances = []
+    for temperature in temperatures:
+        t = temperature - ZERO_CELSIUS
+        r = r0 * (1 + a * t + b * t**2)
+        if t < 0:
+            r += r0 * c * (t - 100) * t**3
+        resistances.append(r)
+
+    return Curve(resistances, temperatures, name)
+
+
+def load_curve(path):
+    # Lake Shore .340 files list "No. Units Temperature" rows after a header;
+    # anything else is read as two columns of temperature (K) and sensor value.
+    name = os.path.splitext(os.path.basename(path))[0]
+    values = []
+    temperatures = []
+    log_ohms = False
+    with open(path) as f:
+        if path.lower().endswith(".340"):
+            for line in f:
+                if line.lower().startswith("data format"):
+                    log_ohms = line.split(":", 1)[1].strip().startswith("4")
+                fields = line.split()
+                if len(fields) == 3 and _numeric(fields):
+                    values.append(10 ** float(fields[1]) if log_ohms else float(fields[1]))
+                    temperatures.append(float(fields[2]))
+        else:
+            for line in f:
+                fields = line.replace(",", " ").split()
+                if len(fields) >= 2 and _numeric(fields[:2]):
+                    temperatures.append(float(fields[0]))
+                    values.append(float(fields[1]))
+
+    logger.debug("Loaded curve %s with %s points from %s", name, len(values), path)
+
+    return Curve(values, temperatures, name)
+
+
+def load_calibrations(path):
+    # {"rtd_a": {"type": "pt100"}, "sd_e": {"type": "curve", "file": "DT670.340"}, ...}
+    with open(path) as f:
+        config = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(path))
+    calibrations = {}
+    for channel, sensor in config.items():
+        match sensor.get("type"):
+            case "pt100":
+                calibrations[channel] = callendar_van_dusen(100.0, name=channel)
+            case "pt1000":
+                calibrations[channel] = callendar_van_dusen(1000.0, name=channel)
+            case "cvd":
+                params = {key: sensor[key] for key in ("r0", "a", "b", "c", "t_min", "t_max", "step") if key in sensor}
+                calibrations[channel] = callendar_van_dusen(name=channel, **params)
+            case "curve":
+                calibrations[channel] = load_curve(os.path.join(base, sensor["file"]))
+            case _:
+                logger.error("Unknown sensor type for channel %s: %s", channel, sensor.get("type"))
+
+    return calibrations
+
+
+def apply(calibrations, readings):
+    return {channel: curve(readings[channel]) for channel, curve in calibrations.items() if channel in readings}
+
+
+def _numeric(fields):
+    try:
+        [float(field) for field in fields]
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,149 @@
+from logging import getLogger
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+
+logger = getLogger(__name__)
+
+DAEMON_SOCKET = "/tmp/hs-temp-sensor.sock"
+DAEMON_INTERVAL = 10.0
+DAEMON_QUERY_TIMEOUT = 5.0
+
+
+class Sampler(threading.Thread):
+    def __init__(self, sample, interval=DAEMON_INTERVAL):
+        super().__init__(name="hs-temp-sensor-sampler", daemon=True)
+        self.sample = sample
+        self.interval = interval
+        self.readings = {}
+        self.timestamp = None
+        self.error = None
+        self.scans = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        
+    def run(self):
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            try:
+                readings = self.sample()
+                with self._lock:
+                    self.readings = readings
+                    self.timestamp = time.time()
+                    self.error = None
+                    self.scans += 1
+            except Exception as e:
+                logger.error("Sampling failed: %s", e)
+                with self._lock:
+                    self.error = str(e)
+            self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - start)))
+            
+    def stop(self):
+        self._stop_event.set()
+        
+    def latest(self):
+        with self._lock:
+            return {"timestamp": self.timestamp, "readings": dict(self.readings)}
+        
+    def status(self):
+        with self._lock:
+            return {"timestamp": self.timestamp, "scans": self.scans, "interval": self.interval, "error": self.error}
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode(errors="replace").strip()
+            match command:
+                case "read":
+                    response = self.server.sampler.latest()
+                case "status":
+                    response = self.server.sampler.status()
+                case "":
+                    continue
+                case _:
+                    response = {"error": "Unknown command: {}".format(command)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class UnixQueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPQueryServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def parse_address(address):
+    # "host:port" selects TCP, anything else is a Unix socket path
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+
+def running(address=DAEMON_SOCKET, timeout=DAEMON_QUERY_TIMEOUT):
+    # True when a daemon accepts connections on the address; a socket file
+    # left behind by one that died refuses them
+    family, connect_address = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(connect_address)
+        except OSError:
+            return False
+    
+    return True
+
+
+def serve(sample, address=DAEMON_SOCKET, interval=DAEMON_INTERVAL):
+    family, bind_address = parse_address(address)
+    if family == socket.AF_UNIX:
+        # Only a stale socket is replaced; the chips belong to a live daemon
+        if running(address):
+            raise RuntimeError("A daemon is already serving on {}".format(address))
+        if os.path.exists(bind_address):
+            os.unlink(bind_address)
+        server = UnixQueryServer(bind_address, QueryHandler)
+    else:
+        server = TCPQueryServer(bind_address, QueryHandler)
+    
+    # SIGTERM shuts down like Ctrl-C so the socket is removed and the caller
+    # can reset the chips; shutdown() blocks until serve_forever() returns,
+    # so it cannot run in the handler itself
+    def terminate(signum, frame):
+        logger.info("Daemon terminated")
+        threading.Thread(target=server.shutdown).start()
+    
+    previous_handler = signal.signal(signal.SIGTERM, terminate)
+    server.sampler = Sampler(sample, interval)
+    server.sampler.start()
+    logger.info("Serving readings on %s every %.1f s", address, interval)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Daemon interrupted")
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        server.sampler.stop()
+        server.sampler.join()
+        server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.unlink(bind_address)
+
+
+def query(address=DAEMON_SOCKET, command="read", timeout=DAEMON_QUERY_TIMEOUT):
+    family, connect_address = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(connect_address)
+        sock.sendall(command.encode() + b"\n")
+        with sock.makefile("rb") as f:
+            response = f.readline()
+    
+    return json.loads(response)
@@ -0,0 +1,153 @@
+from dataclasses import dataclass, replace
+from logging import getLogger
+import csv
+import gzip
+import json
+import math
+import os
+import queue
+import threading
+import time
+
+logger = getLogger(__name__)
+
+EXPORT_PREFIX = "readings"
+# A chunk is written once it has this many rows or is this old, whichever comes first
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_CHUNK_INTERVAL = 3600.0
+EXPORT_COMPRESSLEVEL = 6
+
+
+@dataclass(frozen=True)
+class Threshold:
+    # A reading is published when it moved more than max(absolute,
+    # relative * |last published|) away from the last published value, or
+    # when nothing was published for heartbeat seconds
+    absolute: float = 0.0
+    relative: float = 0.0
+    heartbeat: float | None = None
+
+
+class Deadband:
+    def __init__(self, default=Threshold(), thresholds=None):
+        self.default = default
+        self.thresholds = thresholds or {}
+        self.suppressed = 0
+        self._published = {}
+
+    def threshold(self, channel):
+        return self.thresholds.get(channel, self.default)
+
+    def changed(self, channel, value, timestamp):
+        last = self._published.get(channel)
+        if last is not None:
+            last_value, last_timestamp = last
+            threshold = self.threshold(channel)
+            # Comparing against the last published value keeps slow drifts from slipping through
+            band = max(threshold.absolute, threshold.relative * abs(last_value))
+            # Curves return NaN out of range; only entering or leaving it is a change
+            if math.isnan(value) or math.isnan(last_value):
+                unchanged = math.isnan(value) and math.isnan(last_value)
+            else:
+                unchanged = abs(value - last_value) <= band
+            if unchanged and (threshold.heartbeat is None or timestamp - last_timestamp < threshold.heartbeat):
+                self.suppressed += 1
+                return False
+        self._published[channel] = (value, timestamp)
+        return True
+
+    def apply(self, readings, timestamp):
+        # The subset of a {name: value} reading set that should be published
+        return {name: value for name, value in readings.items() if self.changed(name, value, timestamp)}
+
+    def reset(self, channel=None):
+        if channel is None:
+            self._published.clear()
+        else:
+            self._published.pop(channel, None)
+
+
+def load_deadband(path):
+    # {"default": {"absolute": 0.01, "heartbeat": 300},
+    #  "channels": {"rtd_a": {"relative": 0.001}, ...}}
+    # Channel entries fall back to the default for fields they leave out.
+    with open(path) as f:
+        config = json.load(f)
+
+    default = Threshold(**config.get("default", {}))
+    return Deadband(default, {channel: replace(default, **entry) for channel, entry in config.get("channels", {}).items()})
+
+
+class CSVExporter(threading.Thread):
+    # Collects reading sets on a background thread and writes them as
+    # gzip-compressed CSV chunks, one column per reading. A reading missing
+    # from a row, e.g. one held back by a Deadband, leaves its cell empty.
+    def __init__(self, directory, prefix=EXPORT_PREFIX, chunk_rows=EXPORT_CHUNK_ROWS,
+                 chunk_interval=EXPORT_CHUNK_INTERVAL, compresslevel=EXPORT_COMPRESSLEVEL):
+        super().__init__(name="hs-temp-sensor-exporter", daemon=True)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.chunk_rows = chunk_rows
+        self.chunk_interval = chunk_interval
+        self.compresslevel = compresslevel
+        self.rows = 0
+        self.files = []
+        self._queue = queue.SimpleQueue()
+
+    def submit(self, timestamp, readings):
+        # Never blocks the caller; empty sets are dropped
+        if readings:
+            self._queue.put((timestamp, dict(readings)))
+
+    def close(self):
+        # Writes what is still buffered and waits for the thread
+        self._queue.put(None)
+        self.join()
+
+    def run(self):
+        rows = []
+        started = None
+        while True:
+            timeout = None if not rows else max(0.0, started + self.chunk_interval - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                if not rows:
+                    started = time.monotonic()
+                rows.append(item)
+            if rows and (len(rows) >= self.chunk_rows or time.monotonic() - started >= self.chunk_interval):
+                self._write(rows)
+                rows = []
+        if rows:
+            self._write(rows)
+
+    def _write(self, rows):
+        columns = list(dict.fromkeys(name for _, readings in rows for name in readings))
+        name = "{}-{}".format(self.prefix, time.strftime("%Y%m%d-%H%M%S", time.gmtime(rows[0][0])))
+        path = os.path.join(self.directory, name + ".csv.gz")
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, "{}-{}.csv.gz".format(name, suffix))
+            suffix += 1
+
+        # Written to a temporary file first so consumers never pick up a partial chunk
+        temporary = path + ".tmp"
+        try:
+            with gzip.open(temporary, "wt", newline="", compresslevel=self.compresslevel) as f:
+                writer = csv.writer(f)
+                writer.writerow(["timestamp"] + columns)
+                for timestamp, readings in rows:
+                    writer.writerow(["{:.3f}".format(timestamp)] + [readings.get(column, "") for column in columns])
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.error("Dropping %s exported rows: %s", len(rows), e)
+            return
+
+        self.rows += len(rows)
+        self.files.append(path)
+        logger.debug("Exported %s rows of %s readings to %s", len(rows), len(columns), path)
@@ -0,0 +1,187 @@
+from bisect import bisect_left, insort
+from collections import deque
+from logging import getLogger
+import math
+
+from hs_temp_sensor import ad7124
+
+logger = getLogger(__name__)
+
+
+class Stage:
+    # A streaming filter stage. process() takes the next values of one channel
+    # with their status bytes and returns what the stage emits for them;
+    # state is kept per channel, so one stage serves any number of channels.
+    def __init__(self):
+        self._state = {}
+
+    def reset(self, channel=None):
+        if channel is None:
+            self._state.clear()
+        else:
+            self._state.pop(channel, None)
+
+    def process(self, channel, values, statuses):
+        raise NotImplementedError
+
+
+class RejectStatus(Stage):
+    # Drops samples whose status byte has any of `mask` set
+    def __init__(self, mask=ad7124.AD7124_STATUS_REG_ERROR_FLAG):
+        super().__init__()
+        self.mask = mask
+
+    def process(self, channel, values, statuses):
+        kept = [(value, status) for value, status in zip(values, statuses) if not status & self.mask]
+        if len(kept) < len(values):
+            logger.debug("Rejected %s samples on channel %s", len(values) - len(kept), channel)
+        return [value for value, _ in kept], [status for _, status in kept]
+
+
+class BlockAverage(Stage):
+    # Emits the mean of every `size` samples; the status is the OR of the block's
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+
+    def process(self, channel, values, statuses):
+        total, count, status_or = self._state.get(channel, (0.0, 0, 0))
+        out_values, out_statuses = [], []
+        for value, status in zip(values, statuses):
+            total += value
+            count += 1
+            status_or |= status
+            if count == self.size:
+                out_values.append(total / self.size)
+                out_statuses.append(status_or)
+                total, count, status_or = 0.0, 0, 0
+        self._state[channel] = (total, count, status_or)
+        return out_values, out_statuses
+
+
+class Decimate(Stage):
+    # Passes every `factor`-th sample
+    def __init__(self, factor):
+        super().__init__()
+        self.factor = factor
+
+    def process(self, channel, values, statuses):
+        phase = self._state.get(channel, 0)
+        start = (self.factor - 1 - phase) % self.factor
+        self._state[channel] = (phase + len(values)) % self.factor
+        return list(values[start::self.factor]), list(statuses[start::self.factor])
+
+
+class MovingMedian(Stage):
+    # Median of the last `window` samples, emitted for every sample. The window
+    # is kept sorted, so each sample costs one insertion and one removal in a
+    # list of fixed size, independent of the stream length.
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+
+    def process(self, channel, values, statuses):
+        if channel not in self._state:
+            self._state[channel] = (deque(), [])
+        recent, ordered = self._state[channel]
+        out_values = []
+        for value in values:
+            if len(recent) == self.window:
+                del ordered[bisect_left(ordered, recent.popleft())]
+            recent.append(value)
+            insort(ordered, value)
+            middle = len(ordered) // 2
+            out_values.append(ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2)
+        return out_values, list(statuses)
+
+
+class IIRLowPass(Stage):
+    # First-order low-pass, y += alpha * (x - y), started at the first sample
+    def __init__(self, alpha):
+        super().__init__()
+        if not 0 < alpha <= 1:
+            raise ValueError("IIR coefficient must be in (0, 1], got {}".format(alpha))
+        self.alpha = alpha
+
+    @classmethod
+    def from_cutoff(cls, cutoff, rate):
+        # -3 dB frequency `cutoff` at a sample rate of `rate`, both in Hz
+        return cls(1 - math.exp(-2 * math.pi * cutoff / rate))
+
+    def process(self, channel, values, statuses):
+        alpha = self.alpha
+        y = self._state.get(channel)
+        out_values = []
+        for value in values:
+            y = value if y is None else y + alpha * (value - y)
+            out_values.append(y)
+        self._state[channel] = y
+        return out_values, list(statuses)
+
+
+class Pipeline:
+    def __init__(self, *stages):
+        self.stages = list(stages)
+
+    def __repr__(self):
+        return "Pipeline({})".format(", ".join(type(stage).__name__ for stage in self.stages))
+
+    def reset(self, channel=None):
+        for stage in self.stages:
+            stage.reset(channel)
+
+    def process(self, channel, values, statuses=None):
+        # Any sequence of values works, e.g. a column of SampleLog.to_numpy()
+        if statuses is None:
+            statuses = [0] * len(values)
+        for stage in self.stages:
+            values, statuses = stage.process(channel, values, statuses)
+            if not values:
+                break
+        return values, statuses
+
+    def push(self, channel, value, status=0):
+        # One sample in; the last output it produced, or None
+        values, statuses = self.process(channel, [value], [status])
+        return (values[-1], statuses[-1]) if values else None
+
+    def filter(self, samples):
+        # Filters (channel, data, status) tuples as yielded by AD7124.stream()
+        for channel, data, status in samples:
+            output = self.push(channel, data, status)
+            if output is not None:
+                yield channel, output[0], output[1]
+
+    def apply(self, readings, statuses=None):
+        # Feeds one {name: value} reading set, e.g. a daemon scan, through the
+        # pipeline by name and returns the outputs produced. statuses maps
+        # names to the status byte of the sample each value was converted from.
+        statuses = statuses or {}
+        outputs = {}
+        for name, value in readings.items():
+            output = self.push(name, value, statuses.get(name, 0))
+            if output is not None:
+                outputs[name] = output[0]
+        return outputs
+
+
+def parse_pipeline(spec):
+    # "reject,median:5,iir:0.2,average:4,decimate:2", applied left to right
+    stages = []
+    for item in spec.split(","):
+        name, _, argument = item.strip().partition(":")
+        match name:
+            case "reject":
+                stages.append(RejectStatus(int(argument, 0)) if argument else RejectStatus())
+            case "average":
+                stages.append(BlockAverage(int(argument)))
+            case "decimate":
+                stages.append(Decimate(int(argument)))
+            case "median":
+                stages.append(MovingMedian(int(argument)))
+            case "iir":
+                stages.append(IIRLowPass(float(argument)))
+            case _:
+                raise ValueError("Unknown filter stage: {}".format(item))
+
+    return Pipeline(*stages)
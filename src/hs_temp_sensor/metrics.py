@@ -0,0 +1,132 @@
+from bisect import bisect_left
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+import threading
+
+logger = getLogger(__name__)
+
+METRICS_PREFIX = "hs_temp_sensor"
+# Upper bounds in seconds, from a single SPI transfer up to a slow settled conversion
+METRICS_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def stats(self):
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else 0.0}
+
+
+class Metrics:
+    def __init__(self, device=0):
+        self.device = device
+        self.transactions = defaultdict(int)
+        self.bytes = defaultdict(int)
+        self.xfer_seconds = Histogram()
+        self.ready_wait_seconds = Histogram()
+        self.scan_seconds = Histogram()
+        self.timeouts = 0
+        self.errors = 0
+        self.crc_errors = 0
+        self._lock = threading.Lock()
+
+    def record_xfer(self, label, nbytes, seconds):
+        with self._lock:
+            self.transactions[label] += 1
+            self.bytes[label] += nbytes
+            self.xfer_seconds.observe(seconds)
+
+    def record_ready_wait(self, seconds):
+        with self._lock:
+            self.ready_wait_seconds.observe(seconds)
+
+    def record_scan(self, seconds):
+        with self._lock:
+            self.scan_seconds.observe(seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def record_crc_error(self):
+        with self._lock:
+            self.crc_errors += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "device": self.device,
+                "transactions": dict(self.transactions),
+                "bytes": dict(self.bytes),
+                "xfer_seconds": self.xfer_seconds.stats(),
+                "ready_wait_seconds": self.ready_wait_seconds.stats(),
+                "scan_seconds": self.scan_seconds.stats(),
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "crc_errors": self.crc_errors,
+            }
+
+    def prometheus(self, prefix=METRICS_PREFIX):
+        device = 'device="{}"'.format(self.device)
+        lines = []
+        with self._lock:
+            for label, count in sorted(self.transactions.items()):
+                lines.append('{}_spi_transactions_total{{{},register="{}"}} {}'.format(prefix, device, label, count))
+            for label, count in sorted(self.bytes.items()):
+                lines.append('{}_spi_bytes_total{{{},register="{}"}} {}'.format(prefix, device, label, count))
+            for name, histogram in (("spi_xfer_seconds", self.xfer_seconds),
+                                    ("ready_wait_seconds", self.ready_wait_seconds),
+                                    ("scan_seconds", self.scan_seconds)):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('{}_{}_bucket{{{},le="{}"}} {}'.format(prefix, name, device, bound, cumulative))
+                lines.append('{}_{}_bucket{{{},le="+Inf"}} {}'.format(prefix, name, device, histogram.count))
+                lines.append('{}_{}_sum{{{}}} {}'.format(prefix, name, device, histogram.sum))
+                lines.append('{}_{}_count{{{}}} {}'.format(prefix, name, device, histogram.count))
+            lines.append('{}_ready_timeouts_total{{{}}} {}'.format(prefix, device, self.timeouts))
+            lines.append('{}_errors_total{{{}}} {}'.format(prefix, device, self.errors))
+            lines.append('{}_crc_errors_total{{{}}} {}'.format(prefix, device, self.crc_errors))
+
+        return "\n".join(lines)
+
+
+def prometheus_text(metrics, prefix=METRICS_PREFIX):
+    return "\n".join(m.prometheus(prefix) for m in metrics) + "\n"
+
+
+def serve(metrics, port, host="127.0.0.1"):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text(metrics).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="hs-temp-sensor-metrics", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+
+    return server
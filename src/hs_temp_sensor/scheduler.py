@@ -0,0 +1,170 @@
+from dataclasses import dataclass
+from logging import getLogger
+import json
+import time
+
+from hs_temp_sensor import ad7124
+
+logger = getLogger(__name__)
+
+IOUT_OFF = (0, 0)
+
+COMMISSION_TOLERANCE = 16
+COMMISSION_STABLE_READINGS = 3
+COMMISSION_MAX_TIME = 2.0
+
+
+@dataclass(frozen=True)
+class Measurement:
+    channel: int
+    pin: int = 0
+    current: float = 0
+    settle: float = 0.0
+    # Set when the excitation current also flows through a shared reference
+    # resistor, so no other source may be on while this channel converts
+    exclusive: bool = False
+
+    @property
+    def source(self):
+        return (self.pin, self.current) if self.current else None
+
+
+@dataclass(frozen=True)
+class Step:
+    channels: tuple
+    iout0: tuple
+    iout1: tuple
+    measurements: tuple
+
+
+def plan(measurements):
+    # Groups channels into steps that each need a single IO_CTRL1 state, using
+    # both current outputs, and orders the steps so a source that is already on
+    # stays on the same output instead of being reprogrammed.
+    unexcited = [m for m in measurements if m.source is None]
+    pending = [m for m in measurements if m.source is not None]
+    steps = []
+    active = (IOUT_OFF, IOUT_OFF)
+    while pending:
+        pending.sort(key=lambda m: m.source not in active)
+        first = pending.pop(0)
+        group = [first]
+        sources = [first.source]
+        if not first.exclusive:
+            for m in list(pending):
+                if m.exclusive:
+                    continue
+                if m.source in sources or (len(sources) < 2 and m.pin not in [pin for pin, _ in sources]):
+                    group.append(m)
+                    pending.remove(m)
+                    if m.source not in sources:
+                        sources.append(m.source)
+
+        slots = [source if source in sources else None for source in active]
+        for source in sources:
+            if source not in slots:
+                slots[slots.index(None)] = source
+        active = (slots[0] or IOUT_OFF, slots[1] or IOUT_OFF)
+        steps.append(Step(tuple(m.channel for m in group), active[0], active[1], tuple(group)))
+
+    # Channels without excitation convert alongside whichever step runs first
+    if unexcited:
+        if steps:
+            first = steps[0]
+            steps[0] = Step(tuple(m.channel for m in unexcited) + first.channels, first.iout0, first.iout1,
+                            tuple(unexcited) + first.measurements)
+        else:
+            steps.append(Step(tuple(m.channel for m in unexcited), IOUT_OFF, IOUT_OFF, tuple(unexcited)))
+
+    return steps
+
+
+class ScanScheduler:
+    def __init__(self, measurements, settle_times=None):
+        self.measurements = list(measurements)
+        self.steps = plan(self.measurements)
+        # Commissioned settle times by channel, overriding Measurement.settle
+        self.settle_times = dict(settle_times or {})
+
+    @property
+    def reference(self):
+        # A measurement whose current also excites the shared reference, if any
+        return next((m for m in self.measurements if m.exclusive and m.source is not None), None)
+
+    def excite(self, adc, measurement):
+        # Switches on the source of one measurement alone and lets it settle
+        adc.set_io_control(iout0_ch=measurement.pin, ex_cur=measurement.current, io_control=1)
+        settle = self.settle_times.get(measurement.channel, measurement.settle)
+        if settle:
+            time.sleep(settle)
+
+    def run(self, adc, timeout=None, off=True):
+        # With off set the sources are switched off after the last step, so a
+        # resident caller does not keep heating one sensor between scans
+        results = {}
+        try:
+            for step in self.steps:
+                active = adc.read_excitation()
+                settle = max((self.settle_times.get(m.channel, m.settle) for m in step.measurements
+                              if m.source is not None and m.source not in active), default=0.0)
+                adc.set_io_control(iout0_ch=step.iout0[0], ex_cur=step.iout0[1], io_control=1,
+                                   iout1_ch=step.iout1[0], iout1_cur=step.iout1[1])
+                if settle:
+                    logger.debug("Settling %.4f s for channels %s", settle, step.channels)
+                    time.sleep(settle)
+                results |= adc.scan(step.channels, timeout=timeout)
+        finally:
+            if off:
+                adc.set_io_control(iout0_ch=0, ex_cur=0, io_control=1)
+
+        return results
+
+
+def commission(adc, measurement, tolerance=COMMISSION_TOLERANCE, stable=COMMISSION_STABLE_READINGS, max_time=COMMISSION_MAX_TIME):
+    # Time from switching the source on until successive conversions agree
+    # within `tolerance` codes for `stable` readings in a row. The result
+    # includes one conversion time, so it errs on the long side.
+    mapping = adc.channel_map[measurement.channel]
+    adc.set_io_control(iout0_ch=0, ex_cur=0, io_control=1)
+    # Channel 0 is enabled at power-on; any other enabled map would be
+    # sequenced in between and compared against this channel's samples
+    for channel in range(16):
+        if channel != measurement.channel:
+            adc.set_channel_config(channel=channel, disable=True)
+    adc.set_channel_config(channel=measurement.channel, setup=mapping.setup, ainp=mapping.ainp, ainm=mapping.ainm)
+
+    start = time.monotonic()
+    adc.set_io_control(iout0_ch=measurement.pin, ex_cur=measurement.current, io_control=1)
+    previous = None
+    agreeing = 0
+    settled_at = start
+    while time.monotonic() - start < max_time:
+        data, status = adc.read_data()
+        now = time.monotonic()
+        if ad7124.AD7124_STATUS_REG_CH_ACTIVE(status) != measurement.channel:
+            logger.debug("Discarding sample from channel %s", ad7124.AD7124_STATUS_REG_CH_ACTIVE(status))
+            continue
+        if previous is not None and abs(data - previous) <= tolerance:
+            agreeing += 1
+            if agreeing >= stable:
+                adc.set_channel_config(channel=measurement.channel, disable=True)
+                return settled_at - start
+        else:
+            agreeing = 0
+            settled_at = now
+        previous = data
+
+    adc.set_channel_config(channel=measurement.channel, disable=True)
+    logger.warning("Channel %s did not settle within %.1f s", measurement.channel, max_time)
+
+    return max_time
+
+
+def load_settle_times(path):
+    with open(path) as f:
+        return {bank: {int(channel): seconds for channel, seconds in times.items()} for bank, times in json.load(f).items()}
+
+
+def save_settle_times(path, settle_times):
+    with open(path, "w") as f:
+        json.dump(settle_times, f, indent=4)
@@ -0,0 +1,140 @@
+from logging import getLogger
+from multiprocessing.shared_memory import SharedMemory
+import struct
+import time
+
+from hs_temp_sensor.store import RECORD, RECORD_DTYPE, SAMPLE_RING_CAPACITY
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = getLogger(__name__)
+
+SHM_NAME = "hs-temp-sensor"
+# magic, version, record size, capacity, creation time, sequence
+SHM_HEADER = struct.Struct("<8sHHIdQ")
+SHM_HEADER_SIZE = 64
+SHM_MAGIC = b"HSTSSHM\x00"
+SHM_VERSION = 1
+SHM_SEQUENCE_OFFSET = 24
+SHM_POLL_INTERVAL = 0.01
+
+# The sequence counter works like a seqlock over the whole ring: it is odd
+# while record sequence // 2 is being written and even once it is published,
+# so sequence // 2 records are complete. A reader never blocks the writer; it
+# copies what it wants and checks afterwards that the writer did not lap it.
+
+
+class SharedRing:
+    # Publishes records to a named shared memory block. There is one writer,
+    # so appends must be serialized by the caller (SampleStore does).
+    def __init__(self, name=SHM_NAME, capacity=SAMPLE_RING_CAPACITY):
+        size = SHM_HEADER_SIZE + capacity * RECORD.size
+        try:
+            self._shm = SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a publisher that was killed
+            logger.warning("Replacing existing shared memory block %s", name)
+            stale = SharedMemory(name, track=False)
+            stale.close()
+            stale.unlink()
+            self._shm = SharedMemory(name, create=True, size=size)
+        self.name = name
+        self.capacity = capacity
+        self.count = 0
+        SHM_HEADER.pack_into(self._shm.buf, 0, SHM_MAGIC, SHM_VERSION, RECORD.size, capacity, time.time(), 0)
+        logger.debug("Publishing samples to shared memory %s (%s records)", name, capacity)
+
+    def append(self, timestamp, device, channel, code, status):
+        buf = self._shm.buf
+        struct.pack_into("<Q", buf, SHM_SEQUENCE_OFFSET, 2 * self.count + 1)
+        RECORD.pack_into(buf, SHM_HEADER_SIZE + (self.count % self.capacity) * RECORD.size, timestamp, device, channel, status, code)
+        self.count += 1
+        struct.pack_into("<Q", buf, SHM_SEQUENCE_OFFSET, 2 * self.count)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SharedRingReader:
+    # Attaches to a SharedRing by name from any local process. Reads copy the
+    # raw records out in at most two slices, with no serialization involved.
+    def __init__(self, name=SHM_NAME):
+        # Not tracked, so a reader exiting never unlinks the publisher's block
+        self._shm = SharedMemory(name, track=False)
+        magic, version, record_size, capacity, created, _ = SHM_HEADER.unpack_from(self._shm.buf, 0)
+        if magic != SHM_MAGIC or version != SHM_VERSION or record_size != RECORD.size:
+            self._shm.close()
+            raise ValueError("{} is not a version {} sample ring".format(name, SHM_VERSION))
+        self.name = name
+        self.capacity = capacity
+        self.created = created
+        # Next record poll() returns, and how many were overwritten before it got to them
+        self.position = 0
+        self.lost = 0
+
+    def _sequence(self):
+        return struct.unpack_from("<Q", self._shm.buf, SHM_SEQUENCE_OFFSET)[0]
+
+    @property
+    def count(self):
+        return self._sequence() // 2
+
+    def read(self, start=0):
+        # Returns (first, data): the packed records from index `first` up to the
+        # latest one. `first` is later than `start` when those were overwritten.
+        while True:
+            sequence = self._sequence()
+            end = sequence // 2
+            first = max(start, (sequence + 1) // 2 - self.capacity, 0)
+            data = self._copy(first, end)
+            # Anything the writer started on since then may have clobbered the copy
+            if first >= (self._sequence() + 1) // 2 - self.capacity:
+                return first, data
+
+    def _copy(self, first, end):
+        # The block may be rounded up to whole pages, so both ends are explicit
+        slot = first % self.capacity
+        wrapped = max(slot + end - first - self.capacity, 0)
+        buf = self._shm.buf
+        data = bytes(buf[SHM_HEADER_SIZE + slot * RECORD.size:SHM_HEADER_SIZE + (slot + end - first - wrapped) * RECORD.size])
+        if wrapped:
+            data += bytes(buf[SHM_HEADER_SIZE:SHM_HEADER_SIZE + wrapped * RECORD.size])
+        return data
+
+    def latest(self, n=1):
+        first, data = self.read(max(self.count - n, 0))
+        return list(RECORD.iter_unpack(data))
+
+    def poll(self):
+        # Records published since the last poll, oldest first
+        first, data = self.read(self.position)
+        if first > self.position:
+            logger.debug("Reader of %s lost %s records", self.name, first - self.position)
+            self.lost += first - self.position
+        self.position = first + len(data) // RECORD.size
+        return list(RECORD.iter_unpack(data))
+
+    def follow(self, history=False, interval=SHM_POLL_INTERVAL):
+        # Yields records as they are published, starting with what is still
+        # in the ring when history is set
+        if not history:
+            self.position = self.count
+        while True:
+            records = self.poll()
+            if not records:
+                time.sleep(interval)
+            yield from records
+
+    def to_numpy(self, start=0):
+        first, data = self.read(start)
+        return np.frombuffer(data, dtype=RECORD_DTYPE)
+
+    def close(self):
+        self._shm.close()
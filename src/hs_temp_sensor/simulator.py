@@ -0,0 +1,330 @@
+from logging import getLogger
+import math
+import random
+import time
+
+from hs_temp_sensor import ad7124
+
+logger = getLogger(__name__)
+
+SIM_ID = 0x14
+SIM_DIE_TEMP = 25.0
+SIM_NOISE = 2e-7
+SIM_INTERNAL_REFERENCE = 2.5
+SIM_RTD_REFERENCE_RESISTOR = 5.11*10**3
+# Input-referred offset (fraction of the reference) and PGA gain error above
+# gain 1; the power-on OFFSET/GAIN registers do not cancel either
+SIM_OFFSET_ERROR = 4e-6
+SIM_GAIN_ERROR = 1.5e-3
+SIM_GAIN_NOMINAL = 0x500000
+# Above this SPI clock the simulated cable starts flipping bits on MISO
+SIM_RELIABLE_SPEED = 4000000
+
+# Master clock by ADC_CTRL power mode: low, mid, full, full
+SIM_MCLK = (76800, 153600, 614400, 614400)
+# Conversions needed to settle after a channel switch, by FILTER type
+SIM_SETTLING_CONVERSIONS = {0: 4, 2: 3}
+# Upper bound on conversions simulated in one catch-up step after the host was idle
+SIM_MAX_BACKLOG = 64
+
+
+class SimulatedSensor:
+    def __init__(self, kind, excitation_pin, value, drift=0.001, period=600.0):
+        # kind is "rtd" (value in ohms, ratiometric to the reference resistor)
+        # or "diode" (value in volts, against the internal reference)
+        self.kind = kind
+        self.excitation_pin = excitation_pin
+        self.value = value
+        self.drift = drift
+        self.period = period
+
+    def __call__(self, t):
+        return self.value * (1 + self.drift * math.sin(2 * math.pi * t / self.period))
+
+
+def rtd_signals():
+    return {
+        (2, 3): SimulatedSensor("rtd", 1, 100.0),
+        (5, 6): SimulatedSensor("rtd", 4, 95.0),
+        (9, 10): SimulatedSensor("rtd", 8, 60.0),
+        (12, 13): SimulatedSensor("rtd", 11, 20.0),
+    }
+
+
+def diode_signals():
+    return {
+        (2, 3): SimulatedSensor("diode", 1, 0.55),
+        (5, 6): SimulatedSensor("diode", 4, 0.90),
+        (9, 10): SimulatedSensor("diode", 8, 1.02),
+        (12, 13): SimulatedSensor("diode", 11, 1.10),
+    }
+
+
+class SimulatedAD7124:
+    # Drop-in replacement for spidev.SpiDev that models an AD7124-8 behind the
+    # SPI interface: register map, sequencer, conversion timing, RDY and
+    # continuous read, calibration, CRC. time_scale stretches conversion times; 0 makes every
+    # conversion complete as soon as the previous one has been read.
+    def __init__(self, signals=None, time_scale=1.0, noise=SIM_NOISE, seed=None,
+                 offset_error=SIM_OFFSET_ERROR, gain_error=SIM_GAIN_ERROR, reliable_speed=SIM_RELIABLE_SPEED):
+        self.mode = 0
+        self.max_speed_hz = 0
+        self.signals = signals if signals is not None else {}
+        self.time_scale = time_scale
+        self.noise = noise
+        self.offset_error = offset_error
+        self.gain_error = gain_error
+        self.reliable_speed = reliable_speed
+        self.die_temp = SIM_DIE_TEMP
+        self.transactions = 0
+        self.bytes = 0
+        self.bus = None
+        self.device = None
+        self._random = random.Random(seed)
+        self._epoch = time.monotonic()
+        self._power_on(self._epoch)
+
+    def open(self, bus, device):
+        self.bus = bus
+        self.device = device
+
+    def close(self):
+        self.bus = None
+        self.device = None
+
+    def xfer2(self, data):
+        now = time.monotonic()
+        self.transactions += 1
+        self.bytes += len(data)
+        self._advance(now)
+
+        tx = list(data)
+        if len(tx) >= 8 and all(b == 0xFF for b in tx):
+            self._power_on(now)
+            return [0xFF] * len(tx)
+
+        rx = []
+        i = 0
+        while i < len(tx):
+            crc = bool(self._registers[ad7124.AD7124_ERR_EN_REG] & ad7124.AD7124_ERR_EN_REG_SPI_CRC_ERR_EN)
+            if self._registers[ad7124.AD7124_ADC_CTRL_REG] & ad7124.AD7124_ADC_CTRL_REG_CONT_READ:
+                if tx[i] == self._read_data_command and not self._registers[ad7124.AD7124_STATUS_REG] & ad7124.AD7124_STATUS_REG_RDY:
+                    self._registers[ad7124.AD7124_ADC_CTRL_REG] &= ~ad7124.AD7124_ADC_CTRL_REG_CONT_READ
+                else:
+                    frame = self._data_frame()
+                    if crc:
+                        frame.append(ad7124.crc8(frame, ad7124.AD7124_CRC8_TABLE[self._read_data_command]))
+                    rx += frame[:len(tx) - i]
+                    i += len(frame)
+                    continue
+
+            comms = tx[i]
+            rx.append(0x00)
+            i += 1
+            reg = ad7124.AD7124_COMM_REG_RA(comms)
+            if reg not in ad7124.AD7124_REG_SIZE:
+                continue
+            size = ad7124.AD7124_REG_SIZE[reg]
+            if comms & ad7124.AD7124_COMM_REG_RD:
+                if reg == ad7124.AD7124_DATA_REG:
+                    out = self._data_frame()
+                else:
+                    out = list(self._registers[reg].to_bytes(size, "big"))
+                    if reg == ad7124.AD7124_ERR_REG:
+                        self._clear_errors()
+                if crc:
+                    out.append(ad7124.crc8(out, ad7124.AD7124_CRC8_TABLE[comms]))
+                rx += out[:len(tx) - i]
+                i += len(out)
+            else:
+                length = size + crc
+                if len(tx) - i >= length:
+                    if crc and ad7124.crc8(tx[i - 1:i + length]) != 0:
+                        self._flag_error(ad7124.AD7124_ERR_REG_SPI_CRC_ERR)
+                    else:
+                        self._write(reg, int.from_bytes(bytes(tx[i:i + size]), "big"), now)
+                rx += [0x00] * min(length, len(tx) - i)
+                i += length
+
+        if self.reliable_speed and self.max_speed_hz > self.reliable_speed and rx:
+            if self._random.random() < self.max_speed_hz / self.reliable_speed - 1:
+                rx[self._random.randrange(len(rx))] ^= 1 << self._random.randrange(8)
+
+        return rx[:len(tx)]
+
+    def _flag_error(self, error):
+        self._registers[ad7124.AD7124_ERR_REG] |= error
+        self._registers[ad7124.AD7124_STATUS_REG] |= ad7124.AD7124_STATUS_REG_ERROR_FLAG
+
+    def _clear_errors(self):
+        # The SPI error bits clear when ERR is read
+        self._registers[ad7124.AD7124_ERR_REG] &= ~0x7C
+        if not self._registers[ad7124.AD7124_ERR_REG]:
+            self._registers[ad7124.AD7124_STATUS_REG] &= ~ad7124.AD7124_STATUS_REG_ERROR_FLAG
+
+    @property
+    def _read_data_command(self):
+        return ad7124.AD7124_COMM_REG_RD | ad7124.AD7124_COMM_REG_RA(ad7124.AD7124_DATA_REG)
+
+    def _power_on(self, now):
+        self._registers = {reg: 0 for reg in ad7124.AD7124_REG_SIZE}
+        self._registers[ad7124.AD7124_STATUS_REG] = ad7124.AD7124_STATUS_REG_RDY
+        self._registers[ad7124.AD7124_ID_REG] = SIM_ID
+        self._registers[ad7124.AD7124_ERR_EN_REG] = 0x000040
+        for channel in range(16):
+            self._registers[ad7124.AD7124_CH0_MAP_REG + channel] = 0x0001
+        self._registers[ad7124.AD7124_CH0_MAP_REG] = 0x8001
+        for setup in range(8):
+            self._registers[ad7124.AD7124_CFG0_REG + setup] = 0x0860
+            self._registers[ad7124.AD7124_FILTER0_REG + setup] = 0x060180
+            self._registers[ad7124.AD7124_OFFSET0_REG + setup] = 0x800000
+            self._registers[ad7124.AD7124_GAIN0_REG + setup] = SIM_GAIN_NOMINAL
+        self._calibration_done = None
+        self._restart(now)
+
+    def _write(self, reg, value, now):
+        if reg in (ad7124.AD7124_STATUS_REG, ad7124.AD7124_DATA_REG, ad7124.AD7124_ID_REG,
+                   ad7124.AD7124_ERR_REG, ad7124.AD7124_MCLK_COUNT_REG):
+            return
+        self._registers[reg] = value
+        if reg == ad7124.AD7124_ADC_CTRL_REG and self._mode() in range(ad7124.AD7124_MODE_INTERNAL_ZERO_SCALE, ad7124.AD7124_MODE_SYSTEM_FULL_SCALE + 1):
+            self._calibrate(now)
+            return
+        # Any write that changes the signal path restarts the conversion sequence
+        if reg != ad7124.AD7124_ERR_EN_REG:
+            self._restart(now)
+
+    def _restart(self, now):
+        self._sequence = [channel for channel in range(16)
+                          if self._registers[ad7124.AD7124_CH0_MAP_REG + channel] & ad7124.AD7124_CH_MAP_REG_CH_ENABLE]
+        self._position = 0
+        self._registers[ad7124.AD7124_STATUS_REG] |= ad7124.AD7124_STATUS_REG_RDY
+        self._schedule(now, settling=True)
+
+    def _mode(self):
+        return (self._registers[ad7124.AD7124_ADC_CTRL_REG] >> 2) & 0x0F
+
+    def _calibrate(self, now):
+        # The coefficients are computed up front; RDY only goes low once the
+        # calibration time has passed, and the ADC is then left idle.
+        mode = self._mode()
+        channel = self._sequence[0] if self._sequence else 0
+        setup, fraction, gain, bipolar = self._input(channel, now)
+        offset_reg = ad7124.AD7124_OFFSET0_REG + setup
+        gain_reg = ad7124.AD7124_GAIN0_REG + setup
+        full_scale = 2**23 if bipolar else 2**24
+        match mode:
+            case ad7124.AD7124_MODE_INTERNAL_ZERO_SCALE:
+                self._registers[offset_reg] = 0x800000 + int(round(self._analog(0.0, gain) * full_scale))
+            case ad7124.AD7124_MODE_INTERNAL_FULL_SCALE:
+                if gain > 1:
+                    self._registers[gain_reg] = int(round(SIM_GAIN_NOMINAL / (1 + self.gain_error)))
+            case ad7124.AD7124_MODE_SYSTEM_ZERO_SCALE:
+                self._registers[offset_reg] = 0x800000 + int(round(self._analog(fraction, gain) * full_scale))
+            case ad7124.AD7124_MODE_SYSTEM_FULL_SCALE:
+                span = self._analog(fraction, gain) * full_scale - (self._registers[offset_reg] - 0x800000)
+                if span > 0:
+                    self._registers[gain_reg] = min(int(round(SIM_GAIN_NOMINAL * full_scale / span)), 0xFFFFFF)
+        self._registers[ad7124.AD7124_ADC_CTRL_REG] &= ~(0x0F << 2)
+        self._registers[ad7124.AD7124_ADC_CTRL_REG] |= ad7124.AD7124_ADC_CTRL_REG_MODE(ad7124.AD7124_MODE_IDLE)
+        self._registers[ad7124.AD7124_STATUS_REG] |= ad7124.AD7124_STATUS_REG_RDY
+        self._next_ready = None
+        self._calibration_done = now + self.conversion_time(channel, settling=True) * self.time_scale
+
+    def _schedule(self, start, settling):
+        if not self._sequence or self._mode() != 0:
+            self._next_ready = None
+            return
+        channel = self._sequence[self._position]
+        self._next_ready = start + self.conversion_time(channel, settling) * self.time_scale
+
+    def conversion_time(self, channel, settling=False):
+        setup = (self._registers[ad7124.AD7124_CH0_MAP_REG + channel] >> 12) & 0x07
+        filter_reg = self._registers[ad7124.AD7124_FILTER0_REG + setup]
+        fs = max(filter_reg & 0x7FF, 1)
+        mclk = SIM_MCLK[(self._registers[ad7124.AD7124_ADC_CTRL_REG] >> 6) & 0x03]
+        period = 32 * fs / mclk
+        if settling:
+            return period * SIM_SETTLING_CONVERSIONS.get((filter_reg >> 21) & 0x07, 1)
+        return period
+
+    def _advance(self, now):
+        if self._calibration_done is not None and now >= self._calibration_done:
+            self._registers[ad7124.AD7124_STATUS_REG] &= ~ad7124.AD7124_STATUS_REG_RDY
+            self._calibration_done = None
+        if self._next_ready is None:
+            return
+        if self.time_scale == 0:
+            if self._registers[ad7124.AD7124_STATUS_REG] & ad7124.AD7124_STATUS_REG_RDY:
+                self._complete(now)
+            return
+        for _ in range(SIM_MAX_BACKLOG):
+            if now < self._next_ready:
+                return
+            self._complete(self._next_ready)
+        # Idle for longer than the backlog: resume the sequence from now
+        self._schedule(now, settling=len(self._sequence) > 1)
+
+    def _complete(self, at):
+        channel = self._sequence[self._position]
+        self._registers[ad7124.AD7124_DATA_REG] = self._code(channel, at)
+        status = self._registers[ad7124.AD7124_STATUS_REG] & ~(ad7124.AD7124_STATUS_REG_RDY | 0x0F)
+        self._registers[ad7124.AD7124_STATUS_REG] = status | channel
+        self._position = (self._position + 1) % len(self._sequence)
+        self._schedule(at, settling=len(self._sequence) > 1)
+
+    def _data_frame(self):
+        frame = list(self._registers[ad7124.AD7124_DATA_REG].to_bytes(3, "big"))
+        if self._registers[ad7124.AD7124_ADC_CTRL_REG] & ad7124.AD7124_ADC_CTRL_REG_DATA_STATUS:
+            frame.append(self._registers[ad7124.AD7124_STATUS_REG])
+        self._registers[ad7124.AD7124_STATUS_REG] |= ad7124.AD7124_STATUS_REG_RDY
+        return frame
+
+    def _excited_pins(self):
+        io_control = self._registers[ad7124.AD7124_IO_CTRL1_REG]
+        pins = set()
+        if (io_control >> 8) & 0x07:
+            pins.add(io_control & 0x0F)
+        if (io_control >> 11) & 0x07:
+            pins.add((io_control >> 4) & 0x0F)
+        return pins
+
+    def _input(self, channel, at):
+        # (setup, differential input as a fraction of the reference, gain, bipolar)
+        channel_map = self._registers[ad7124.AD7124_CH0_MAP_REG + channel]
+        setup = (channel_map >> 12) & 0x07
+        ainp = (channel_map >> 5) & 0x1F
+        ainm = channel_map & 0x1F
+        config = self._registers[ad7124.AD7124_CFG0_REG + setup]
+        gain = 1 << (config & 0x07)
+
+        fraction = 0.0
+        sensor = self.signals.get((ainp, ainm))
+        if sensor is not None and sensor.excitation_pin in self._excited_pins():
+            value = sensor(at - self._epoch)
+            if sensor.kind == "rtd":
+                fraction = value / SIM_RTD_REFERENCE_RESISTOR
+            else:
+                fraction = value / SIM_INTERNAL_REFERENCE
+
+        return setup, fraction, gain, bool(config & ad7124.AD7124_CFG_REG_BIPOLAR)
+
+    def _analog(self, fraction, gain):
+        # Modulator input as a fraction of full scale, including the front-end errors
+        return (fraction + self.offset_error) * gain * (1 + (self.gain_error if gain > 1 else 0.0))
+
+    def _code(self, channel, at):
+        channel_map = self._registers[ad7124.AD7124_CH0_MAP_REG + channel]
+        if ((channel_map >> 5) & 0x1F, channel_map & 0x1F) == (16, 17):
+            return int(0x800000 + 13584 * (self.die_temp + 272.5))
+
+        setup, fraction, gain, bipolar = self._input(channel, at)
+        fraction += self._random.gauss(0.0, self.noise)
+
+        offset = self._registers[ad7124.AD7124_OFFSET0_REG + setup] - 0x800000
+        scale = self._registers[ad7124.AD7124_GAIN0_REG + setup] / SIM_GAIN_NOMINAL
+        if bipolar:
+            code = 2**23 + (self._analog(fraction, gain) * 2**23 - offset) * scale
+        else:
+            code = (self._analog(fraction, gain) * 2**24 - offset) * scale
+        return min(max(int(round(code)), 0), 0xFFFFFF)
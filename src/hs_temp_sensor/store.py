@@ -0,0 +1,159 @@
+from bisect import bisect_left
+from logging import getLogger
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = getLogger(__name__)
+
+# timestamp (s), device, channel, status, raw code
+RECORD = struct.Struct("<dHBBI")
+RECORD_DTYPE = [("timestamp", "<f8"), ("device", "<u2"), ("channel", "u1"), ("status", "u1"), ("code", "<u4")]
+
+# magic, version, record size, record count, creation time
+LOG_HEADER = struct.Struct("<8sHHQd")
+LOG_HEADER_SIZE = 64
+LOG_MAGIC = b"HSTSLOG\x00"
+LOG_VERSION = 1
+LOG_GROW_RECORDS = 65536
+LOG_COUNT_OFFSET = 12
+
+SAMPLE_RING_CAPACITY = 65536
+
+
+class SampleRing:
+    def __init__(self, capacity=SAMPLE_RING_CAPACITY):
+        self.capacity = capacity
+        self.count = 0
+        self._buffer = bytearray(capacity * RECORD.size)
+
+    def append(self, timestamp, device, channel, code, status):
+        RECORD.pack_into(self._buffer, (self.count % self.capacity) * RECORD.size, timestamp, device, channel, status, code)
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def views(self):
+        # Oldest-first contents as at most two zero-copy slices of the buffer
+        view = memoryview(self._buffer)
+        if self.count <= self.capacity:
+            return (view[:self.count * RECORD.size],)
+        split = (self.count % self.capacity) * RECORD.size
+        return (view[split:], view[:split])
+
+    def latest(self, n=1):
+        n = min(n, len(self))
+        return [RECORD.unpack_from(self._buffer, ((self.count - n + i) % self.capacity) * RECORD.size) for i in range(n)]
+
+    def to_numpy(self):
+        return np.concatenate([np.frombuffer(view, dtype=RECORD_DTYPE) for view in self.views()])
+
+
+class SampleLog:
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            self._file = open(path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._check_header()
+            return
+
+        exists = os.path.exists(path) and os.path.getsize(path) >= LOG_HEADER_SIZE
+        self._file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self._file.truncate(LOG_HEADER_SIZE + LOG_GROW_RECORDS * RECORD.size)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        if exists:
+            self._check_header()
+        else:
+            LOG_HEADER.pack_into(self._mmap, 0, LOG_MAGIC, LOG_VERSION, RECORD.size, 0, time.time())
+        logger.debug("Opened sample log %s with %s records", path, len(self))
+
+    def _check_header(self):
+        magic, version, record_size, count, created = LOG_HEADER.unpack_from(self._mmap, 0)
+        if magic != LOG_MAGIC or version != LOG_VERSION or record_size != RECORD.size:
+            raise ValueError("{} is not a version {} sample log".format(self.path, LOG_VERSION))
+        self.created = created
+
+    def __len__(self):
+        count = struct.unpack_from("<Q", self._mmap, LOG_COUNT_OFFSET)[0]
+        # A read-only map stays at the size the file had when it was opened
+        return min(count, (len(self._mmap) - LOG_HEADER_SIZE) // RECORD.size)
+
+    def append(self, timestamp, device, channel, code, status):
+        count = len(self)
+        offset = LOG_HEADER_SIZE + count * RECORD.size
+        if offset + RECORD.size > len(self._mmap):
+            self._mmap.resize(len(self._mmap) + LOG_GROW_RECORDS * RECORD.size)
+        RECORD.pack_into(self._mmap, offset, timestamp, device, channel, status, code)
+        # The count is published after the record so a reader never sees a partial one
+        struct.pack_into("<Q", self._mmap, LOG_COUNT_OFFSET, count + 1)
+
+    def records(self):
+        return memoryview(self._mmap)[LOG_HEADER_SIZE:LOG_HEADER_SIZE + len(self) * RECORD.size]
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("sample log index out of range")
+        return RECORD.unpack_from(self._mmap, LOG_HEADER_SIZE + index * RECORD.size)
+
+    def __iter__(self):
+        with self.records() as view:
+            yield from RECORD.iter_unpack(view)
+
+    def find(self, timestamp):
+        # Records are appended in time order, so fixed-size offsets are the index
+        return bisect_left(self, timestamp, key=lambda record: record[0])
+
+    def to_numpy(self):
+        return np.frombuffer(self._mmap, dtype=RECORD_DTYPE, count=len(self), offset=LOG_HEADER_SIZE)
+
+    def flush(self):
+        if not self.readonly:
+            self._mmap.flush()
+
+    def close(self):
+        if not self.readonly:
+            size = LOG_HEADER_SIZE + len(self) * RECORD.size
+            self._mmap.flush()
+            self._mmap.close()
+            self._file.truncate(size)
+        else:
+            self._mmap.close()
+        self._file.close()
+
+
+class SampleStore:
+    def __init__(self, capacity=SAMPLE_RING_CAPACITY, log_path=None, shared=None):
+        self.ring = SampleRing(capacity)
+        self.log = SampleLog(log_path) if log_path else None
+        # Any further ring with the same append, e.g. a shm.SharedRing for other processes
+        self.shared = shared
+        self._lock = threading.Lock()
+
+    def append(self, device, data, status, timestamp=None):
+        # Takes a read_data result directly; the channel comes from the status byte
+        if timestamp is None:
+            timestamp = time.time()
+        channel = status & 0x0F
+        with self._lock:
+            self.ring.append(timestamp, device, channel, data, status)
+            if self.log is not None:
+                self.log.append(timestamp, device, channel, data, status)
+            if self.shared is not None:
+                self.shared.append(timestamp, device, channel, data, status)
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+        if self.shared is not None:
+            self.shared.close()
@@ -0,0 +1,242 @@
+from dataclasses import dataclass
+from logging import getLogger
+import json
+import os
+
+from hs_temp_sensor import acquisition, ad7124, calibration, conversion, metrics, scheduler
+
+logger = getLogger(__name__)
+
+# Channel 0 of every board reads the die temperature through this setup at
+# gain 1, which the conversion in read_die_temp assumes
+DIE_TEMP_CHANNEL = 0
+DIE_TEMP_SETUP = 1
+MAX_SENSORS = 15
+
+
+@dataclass(frozen=True)
+class SensorType:
+    setup: ad7124.Setup
+    current: float
+    # Excitation returns through a reference shared by the board, see scheduler.Measurement
+    exclusive: bool
+    convert: object
+    quantity: str
+    unit: str
+
+
+SENSOR_TYPES = {
+    "rtd": SensorType(ad7124.Setup(gain=conversion.RTD_GAIN), 500, True, conversion.rtd_resistance, "Resistance", "Ω"),
+    "diode": SensorType(ad7124.Setup(gain=conversion.SD_GAIN), 50, False, conversion.sd_voltage, "Voltage", "V"),
+}
+
+# The two HISPEC 4-wire boards: four sensors of one type on the same inputs
+# and IOUT pins, RTDs on chip select 0 and silicon diodes on chip select 1
+BUILTIN_INPUTS = ((2, 3, 1), (5, 6, 4), (9, 10, 8), (12, 13, 11))
+BUILTIN_SENSORS = {
+    "rtd": ("rtd_a", "rtd_b", "rtd_c", "rtd_d"),
+    "diode": ("sd_e", "sd_f", "sd_g", "sd_h"),
+}
+BUILTIN_BOARDS = {0: "rtd", 1: "diode"}
+
+
+@dataclass(frozen=True)
+class Sensor:
+    name: str
+    type: str
+    ainp: int
+    ainm: int
+    pin: int
+    current: float | None = None
+    settle: float = 0.0
+
+
+class Board:
+    def __init__(self, name, adc, sensors):
+        if len(sensors) > MAX_SENSORS:
+            raise ValueError("Board {} has {} sensors, at most {} fit next to the die temperature".format(name, len(sensors), MAX_SENSORS))
+        for sensor in sensors:
+            if sensor.type not in SENSOR_TYPES:
+                raise ValueError("Unknown sensor type for {}: {}".format(sensor.name, sensor.type))
+        self.name = name
+        self.sensors = list(sensors)
+        self.adc = adc
+        # Register state file (see AD7124.save_registers); when set, the chip
+        # is verified against it on configure instead of being reset, and
+        # left configured on close for the next process
+        self.state = None
+
+        # One setup per sensor type in use, around the die temperature setup
+        slots = [slot for slot in range(8) if slot != DIE_TEMP_SETUP]
+        self.type_setups = dict(zip(sorted({sensor.type for sensor in self.sensors}), slots))
+        self.setups = {DIE_TEMP_SETUP: ad7124.Setup(gain=1)} \
+                    | {slot: SENSOR_TYPES[kind].setup for kind, slot in self.type_setups.items()}
+        self.names = {DIE_TEMP_CHANNEL: name + "_die_temp"} | {channel: sensor.name for channel, sensor in enumerate(self.sensors, 1)}
+        self.channels = {DIE_TEMP_CHANNEL: ad7124.Channel(ainp=16, ainm=17, setup=DIE_TEMP_SETUP)} \
+                      | {channel: ad7124.Channel(sensor.ainp, sensor.ainm, setup=self.type_setups[sensor.type])
+                         for channel, sensor in enumerate(self.sensors, 1)}
+
+        measurements = [scheduler.Measurement(DIE_TEMP_CHANNEL)]
+        for channel, sensor in enumerate(self.sensors, 1):
+            kind = SENSOR_TYPES[sensor.type]
+            measurements.append(scheduler.Measurement(channel, pin=sensor.pin, current=sensor.current or kind.current,
+                                                      settle=sensor.settle, exclusive=kind.exclusive))
+        self.scheduler = scheduler.ScanScheduler(measurements)
+
+    def __repr__(self):
+        return "Board({!r}, bus {}, device {}, {} sensors)".format(self.name, self.adc.spi_bus, self.adc.spi_device, len(self.sensors))
+
+    def configure(self, cal_cache=None, recalibrate=False):
+        if self.state is None:
+            self.adc.initialize()
+        else:
+            self.adc.resume(self.state)
+        self.adc.read_id()
+        # After resume() only what the saved state got wrong is written
+        self.adc.configure(self.setups, self.channels)
+        if cal_cache is not None:
+            # Every setup references REFIN1; on boards with RTDs it is only
+            # driven while an RTD current flows through the reference resistor
+            reference = self.scheduler.reference
+            if reference is not None:
+                self.scheduler.excite(self.adc, reference)
+            die_temp = self.adc.read_die_temp(self.adc.scan([DIE_TEMP_CHANNEL])[DIE_TEMP_CHANNEL][0])
+            calibration.restore(self.adc, self.setups, cal_cache, die_temp, force=recalibrate)
+            if reference is not None:
+                self.adc.set_io_control(iout0_ch=0, ex_cur=0, io_control=1)
+        if self.state is not None:
+            self.adc.save_registers(self.state)
+
+    def read(self):
+        results = self.scheduler.run(self.adc)
+        readings = {self.names[DIE_TEMP_CHANNEL]: self.adc.read_die_temp(results[DIE_TEMP_CHANNEL][0])}
+        for channel, sensor in enumerate(self.sensors, 1):
+            readings[self.names[channel]] = SENSOR_TYPES[sensor.type].convert(results[channel][0])
+
+        return readings
+
+    def test(self, cal_cache=None, recalibrate=False):
+        # One configure and read, leaving the chip reset as it was found
+        self.configure(cal_cache, recalibrate)
+        readings = self.read()
+        self.adc.reset()
+
+        return readings
+
+    def commission(self):
+        # {channel: settle time} of every excited channel, see scheduler.commission
+        self.configure()
+        settle_times = {m.channel: scheduler.commission(self.adc, m) for m in self.scheduler.measurements if m.source is not None}
+        self.adc.reset()
+
+        return settle_times
+
+
+class Topology:
+    # Runs every board in its own worker, so the chips convert concurrently;
+    # boards sharing a bus take turns for each transfer on the driver's bus
+    # lock. SPI clock calibration runs one worker per bus, as the clock
+    # belongs to the bus.
+    def __init__(self, boards, state=None):
+        self.boards = list(boards)
+        # Directory of per-board register state files, see Board.state
+        if state is not None:
+            os.makedirs(state, exist_ok=True)
+            for board in self.boards:
+                board.state = os.path.join(state, "{}.json".format(board.name))
+        self.buses = {}
+        for board in self.boards:
+            self.buses.setdefault(board.adc.spi_bus, []).append(board)
+        addresses = [(board.adc.spi_bus, board.adc.spi_device) for board in self.boards]
+        if len(set(addresses)) != len(addresses):
+            raise ValueError("Two boards share a bus and chip select")
+        names = [board.name for board in self.boards]
+        if len(set(names)) != len(names):
+            raise ValueError("Two boards share a name")
+
+    @property
+    def adcs(self):
+        return [board.adc for board in self.boards]
+
+    @property
+    def reading_names(self):
+        # {(source, channel): reading name}, as samples reach a sink
+        return {(board.adc.source, channel): name for board in self.boards for channel, name in board.names.items()}
+
+    def connect(self, calibrate_spi=False):
+        for board in self.boards:
+            board.adc.connect()
+        if calibrate_spi:
+            self._per_bus(lambda board: board.adc.calibrate_spi_speed())
+
+    def configure(self, cal_cache=None, recalibrate=False):
+        self._per_board(lambda board: board.configure(cal_cache, recalibrate))
+
+    def commission(self):
+        # {board name: {channel: settle time}}, as save_settle_times stores it
+        results = self._per_board(Board.commission)
+
+        return {board.name: results[board.name] for board in self.boards}
+
+    def set_settle_times(self, settle_times):
+        for board in self.boards:
+            board.scheduler.settle_times = settle_times.get(board.name, {})
+
+    def read(self):
+        results = self._per_board(Board.read)
+        readings = {}
+        for board in self.boards:
+            readings |= results[board.name]
+
+        return readings
+
+    def close(self):
+        for board in self.boards:
+            if board.state is None:
+                board.adc.reset()
+            else:
+                board.adc.save_registers(board.state)
+            board.adc.close()
+
+    def _per_board(self, function):
+        # {board name: function(board)}
+        return acquisition.acquire({board.name: (board, function) for board in self.boards})
+
+    def _per_bus(self, function):
+        # {bus: [function(board) for each board on the bus]}
+        return acquisition.acquire({bus: (boards, lambda boards: [function(board) for board in boards])
+                                    for bus, boards in self.buses.items()})
+
+
+def builtin_channels(kind):
+    # The "channels" of one of the BUILTIN_BOARDS in the load_topology format
+    return {name: {"type": kind, "ainp": ainp, "ainm": ainm, "pin": pin}
+            for name, (ainp, ainm, pin) in zip(BUILTIN_SENSORS[kind], BUILTIN_INPUTS)}
+
+
+def builtin_board(kind, adc):
+    # A board of BUILTIN_SENSORS[kind] on an existing chip, named after its chip select
+    return Board("adc{}".format(adc.spi_device), adc, [Sensor(name, **sensor) for name, sensor in builtin_channels(kind).items()])
+
+
+def load_topology(path=None, with_metrics=False, spi_factory=None, state=None, **adc_options):
+    # {"boards": [{"name": "adc0", "bus": 0, "device": 0,
+    #              "channels": {"rtd_a": {"type": "rtd", "ainp": 2, "ainm": 3, "pin": 1}, ...}}, ...]}
+    # Without a path, the built-in boards are loaded.
+    if path is None:
+        config = {"boards": [{"name": "adc{}".format(device), "device": device, "channels": builtin_channels(kind)}
+                             for device, kind in BUILTIN_BOARDS.items()]}
+    else:
+        with open(path) as f:
+            config = json.load(f)
+
+    boards = []
+    for board in config["boards"]:
+        sensors = [Sensor(name, **sensor) for name, sensor in board["channels"].items()]
+        adc = ad7124.AD7124(board["device"], bus=board.get("bus", ad7124.AD7124_SPI_BUS),
+                            metrics=metrics.Metrics(board["name"]) if with_metrics else None,
+                            spi=spi_factory() if spi_factory is not None else None, **adc_options)
+        boards.append(Board(board["name"], adc, sensors))
+        logger.debug("Loaded %r", boards[-1])
+
+    return Topology(boards, state)
@@ -0,0 +1,177 @@
+from logging import getLogger
+import json
+import os
+import struct
+import threading
+import time
+
+from hs_temp_sensor import ad7124, calibration
+
+logger = getLogger(__name__)
+
+# magic, version, creation time
+TRACE_HEADER = struct.Struct("<8sHd")
+TRACE_MAGIC = b"HSTSTRC\x00"
+TRACE_VERSION = 1
+# timestamp (s), source ((bus << 4) | chip select), tx length, rx length; the
+# tx and rx bytes follow each record header
+TRACE_RECORD = struct.Struct("<dBHH")
+# The calibration cache as a recording started, kept next to the trace
+TRACE_CALIBRATION_SUFFIX = ".cal.json"
+
+
+class TraceWriter:
+    # Appends transfers from any number of RecordingTransports to one file.
+    # Each record is a single unbuffered write, so a killed process leaves at
+    # most the record in flight behind.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "ab", buffering=0)
+        if self._file.tell() == 0:
+            self._file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, time.time()))
+        logger.debug("Recording SPI trace to %s", path)
+
+    def write(self, source, tx, rx, timestamp=None):
+        record = TRACE_RECORD.pack(time.time() if timestamp is None else timestamp, source, len(tx), len(rx)) + bytes(tx) + bytes(rx)
+        with self._lock:
+            self._file.write(record)
+
+    def close(self):
+        self._file.close()
+
+
+def read_trace(path, source=None):
+    # Yields (timestamp, source, tx, rx), optionally for a single source
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, created = TRACE_HEADER.unpack_from(data, 0)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError("{} is not a version {} SPI trace".format(path, TRACE_VERSION))
+
+    offset = TRACE_HEADER.size
+    while offset + TRACE_RECORD.size <= len(data):
+        timestamp, record_source, tx_length, rx_length = TRACE_RECORD.unpack_from(data, offset)
+        offset += TRACE_RECORD.size
+        if offset + tx_length + rx_length > len(data):
+            logger.warning("Ignoring truncated record at the end of %s", path)
+            break
+        tx = data[offset:offset + tx_length]
+        rx = data[offset + tx_length:offset + tx_length + rx_length]
+        offset += tx_length + rx_length
+        if source is None or record_source == source:
+            yield timestamp, record_source, tx, rx
+
+
+class RecordingTransport:
+    # Wraps a spidev-compatible object and writes every xfer2 to a TraceWriter
+    def __init__(self, writer, spi=None):
+        if spi is None:
+            if ad7124.spidev is None:
+                raise ImportError("spidev is required to talk to an AD7124 over SPI")
+            spi = ad7124.spidev.SpiDev()
+        self.spi = spi
+        self.writer = writer
+        self.source = 0
+
+    @property
+    def mode(self):
+        return self.spi.mode
+
+    @mode.setter
+    def mode(self, mode):
+        self.spi.mode = mode
+
+    @property
+    def max_speed_hz(self):
+        return self.spi.max_speed_hz
+
+    @max_speed_hz.setter
+    def max_speed_hz(self, speed):
+        self.spi.max_speed_hz = speed
+
+    def open(self, bus, device):
+        self.source = (bus << 4) | device
+        self.spi.open(bus, device)
+
+    def close(self):
+        self.spi.close()
+
+    def xfer2(self, data):
+        rx = self.spi.xfer2(data)
+        self.writer.write(self.source, data, rx)
+        return rx
+
+
+class ReplayTransport:
+    # Plays the transfers recorded for one chip back to an unmodified driver,
+    # as fast as it asks for them. With strict set, a transfer that differs
+    # from the recorded one raises, as the responses would no longer match.
+    def __init__(self, path, strict=True):
+        self.path = path
+        self.strict = strict
+        self.mode = 0
+        self.max_speed_hz = 0
+        self.transactions = 0
+        self.bytes = 0
+        self._records = []
+        self._position = 0
+
+    def open(self, bus, device):
+        self._records = [(tx, rx) for _, _, tx, rx in read_trace(self.path, (bus << 4) | device)]
+        self._position = 0
+        logger.debug("Replaying %s transfers for bus %s device %s from %s", len(self._records), bus, device, self.path)
+
+    def close(self):
+        pass
+
+    def rewind(self):
+        self._position = 0
+
+    def __len__(self):
+        return len(self._records) - self._position
+
+    def xfer2(self, data):
+        if self._position >= len(self._records):
+            raise EOFError("SPI trace {} exhausted after {} transfers".format(self.path, self._position))
+        tx, rx = self._records[self._position]
+        if self.strict and bytes(data) != tx:
+            raise ValueError("SPI trace {} diverged at transfer {}: sent {}, recorded {}".format(
+                self.path, self._position, bytes(data).hex(), tx.hex()))
+        self._position += 1
+        self.transactions += 1
+        self.bytes += len(data)
+        return list(rx)
+
+
+def save_calibration(path, cal_cache=None, recalibrate=False):
+    # Whether setups are calibrated or restored depends on the calibration
+    # cache, so its contents at the start of the recording are saved for the
+    # replay. A trace that is appended to keeps the first recording's snapshot.
+    snapshot_path = path + TRACE_CALIBRATION_SUFFIX
+    if os.path.exists(snapshot_path):
+        return
+    snapshot = {"timestamp": time.time(), "enabled": cal_cache is not None, "recalibrate": recalibrate,
+                "cache": calibration.load_cache(cal_cache) if cal_cache is not None else {}}
+    with open(snapshot_path, "w") as f:
+        json.dump(snapshot, f, indent=4)
+
+
+def replay_calibration(path, cal_cache):
+    # Returns the cal_cache/recalibrate options that make a replay take the
+    # recorded run's calibration decisions. The recorded cache is written
+    # afresh to `cal_cache`, with every entry as old as it was then. Without a
+    # snapshot, chip calibration is off.
+    try:
+        with open(path + TRACE_CALIBRATION_SUFFIX) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        logger.debug("No calibration snapshot for %s, replaying without chip calibration", path)
+        return {"cal_cache": None, "recalibrate": False}
+    if not snapshot["enabled"]:
+        return {"cal_cache": None, "recalibrate": False}
+
+    shift = time.time() - snapshot["timestamp"]
+    calibration.save_cache(cal_cache, {key: entry | {"timestamp": entry["timestamp"] + shift}
+                                       for key, entry in snapshot["cache"].items()})
+    return {"cal_cache": cal_cache, "recalibrate": snapshot["recalibrate"]}